@@ -1,12 +1,15 @@
 import os
 import streamlit as st
 import google.generativeai as genai
-from langchain_community.document_loaders import PyPDFLoader, TextLoader, UnstructuredWordDocumentLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain.chains import RetrievalQA
 from langchain_google_genai import ChatGoogleGenerativeAI
+from rag_index import IndexConfig, read_manifest, manifest_version
+from rag_embeddings import shared_limiter
+from rag_retrieval import make_retriever
+from rag_cache import SemanticAnswerCache, QueryEmbeddingCache
+from rag_chain import RagChain
+from rag_context import ContextBuilder, ContextCompressor
+from rag_metrics import RequestTimer, TimedEmbeddings, MetricsLog, STAGES
+from rag_service import TenantIndexes, DEFAULT_TENANT, list_tenants, tenant_config
 
 # =========================
 # إعدادات عامة
@@ -22,95 +25,322 @@ else:
 # =========================
 # تحميل بيانات الشركة من مجلد data/
 # =========================
+# الفهرس يُحفظ في مجلد index/ مع بصمات الملفات، ويُعاد بناؤه فقط عند تغيّر البيانات.
+# التحديث يجري في خيط خلفي؛ حتى ينتهي تُجاب الأسئلة من الفهرس المحفوظ السابق.
+# لكل مستأجر (tenants/<الاسم>/data) فهرسه، يُحمّل عند أول طلب ويشترك الجميع في سقف ذاكرة واحد
 @st.cache_resource
-def load_and_index_data():
-    docs = []
-    data_dir = "data"
-
-    if not os.path.exists(data_dir):
-        os.makedirs(data_dir)
-
-    for file in os.listdir(data_dir):
-        file_path = os.path.join(data_dir, file)
-        if file.endswith(".pdf"):
-            loader = PyPDFLoader(file_path)
-        elif file.endswith(".txt"):
-            loader = TextLoader(file_path)
-        elif file.endswith(".docx"):
-            loader = UnstructuredWordDocumentLoader(file_path)
-        else:
-            continue
-        docs.extend(loader.load())
+def get_tenant_indexes():
+    config = IndexConfig.from_env()
+    embeddings = config.make_embeddings()
+    if config.query_cache_size > 0:
+        # متجهات الأسئلة المتكررة تُقرأ من الذاكرة بدل استدعاء مزود التضمين (لكل الجلسات والمستأجرين)
+        embeddings = QueryEmbeddingCache(embeddings, max_entries=config.query_cache_size)
+    # التغليف يسجل زمن تضمين السؤال في مقاييس كل طلب
+    embeddings = TimedEmbeddings(embeddings)
+    return TenantIndexes(config, embeddings, max_bytes=config.tenant_cache_mb * 1024 * 1024)
+
+def get_index_service(tenant):
+    return get_tenant_indexes().get(tenant)
+
+# ذاكرة إجابات لكل مستأجر، مشتركة بين كل جلساته في العملية
+@st.cache_resource
+def get_answer_cache(tenant):
+    config = IndexConfig.from_env()
+    return SemanticAnswerCache(
+        threshold=config.answer_cache_threshold,
+        ttl=config.answer_cache_ttl,
+        max_entries=config.answer_cache_size,
+    )
+
+# سجل أزمنة الطلبات المشترك (ملف JSONL دوّار)
+@st.cache_resource
+def get_metrics_log():
+    config = IndexConfig.from_env()
+    return MetricsLog(config.metrics_path, max_records=config.metrics_max_records)
 
-    # تقسيم النصوص
-    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-    chunks = splitter.split_documents(docs)
+# تعبئة السياق حسب ميزانية الرموز؛ تُنشأ مرة واحدة لأن تحميل ترميز tiktoken مكلف.
+# الضاغط يبقي الجمل ذات الصلة بالسؤال فقط قبل التعبئة، بنفس مزود التضمين المشترك دون
+# غلاف التوقيت: زمنه محسوب في prompt_assembly، ومتجه السؤال يأتي من ذاكرة الأسئلة عادةً
+@st.cache_resource
+def get_context_builder():
+    config = IndexConfig.from_env()
+    compressor = None
+    if config.context_compression > 0:
+        limiter = None
+        if config.is_remote_embedding() and config.embed_rpm:
+            limiter = shared_limiter(config.embed_rpm, config.embed_workers)
+        compressor = ContextCompressor(
+            get_tenant_indexes().embeddings.inner,
+            keep_ratio=config.context_compression,
+            lexical_weight=config.context_compression_lexical,
+            limiter=limiter,
+            batch_size=config.embed_batch_size,
+            max_retries=config.embed_max_retries,
+        )
+    return ContextBuilder(
+        token_budget=config.context_token_budget,
+        encoding_name=config.context_encoding,
+        compressor=compressor,
+    )
 
-    # إنشاء الفهارس باستخدام FAISS
-    embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-    vectorstore = FAISS.from_documents(chunks, embeddings)
+def lookup_cached_answer(index, user_q, timer, tenant, use_cache=True):
+    # الأسئلة المتكررة أو شبه المتطابقة تُجاب من الذاكرة دون استدعاء Gemini
+    # يعيد ((الإجابة، المصادر، التشابه) أو None، متجه السؤال لتخزين الإجابة الجديدة)
+    if not use_cache or IndexConfig.from_env().answer_cache_size <= 0:
+        return None, None
+    with timer.activate():
+        query_vector = index.vectorstore.embeddings.embed_query(user_q)
+    cached = get_answer_cache(tenant).lookup(query_vector, manifest_version(index.manifest), user_q)
+    timer.info["cache_hit"] = cached is not None
+    return cached, query_vector
 
-    return vectorstore
+def show_sources(sources, timer):
+    with timer.stage("source_rendering"), st.expander("📎 المصادر"):
+        for doc in sources:
+            st.write(doc.metadata.get("source", "غير معروف"))
+            st.write(doc.page_content[:200] + "...")
 
 # =========================
 # إعداد السلاسل (QA Chain)
 # =========================
-def get_qa_chain(vectorstore):
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
-    llm = ChatGoogleGenerativeAI(model="gemini-pro", temperature=0.2)
-    chain = RetrievalQA.from_chain_type(
-        llm=llm,
-        retriever=retriever,
-        return_source_documents=True
-    )
-    return chain
+def get_llm():
+    return ChatGoogleGenerativeAI(model="gemini-pro", temperature=0.2)
+
+def get_qa_chain(index, filters=None, all_languages=False):
+    # الاسترجاع الافتراضي هجين: FAISS + BM25؛ أو dense أو hierarchical (انظر RAG_RETRIEVER_MODE)
+    config = IndexConfig.from_env()
+    if all_languages:
+        config.retriever_language = "off"
+    retriever = make_retriever(index, config, filters=filters)
+    return RagChain(retriever, get_llm(), context_builder=get_context_builder())
+
+def search_filters(index):
+    # تصفية يدوية للبحث؛ يعيد (filters، all_languages). بدونها يُبحث في مقاطع لغة السؤال
+    if index.filters is None:
+        return {}, False
+    with st.expander("🔎 تصفية البحث"):
+        language = st.selectbox("اللغة", ["تلقائي (لغة السؤال)", "ar", "en", "كل اللغات"])
+        categories = st.multiselect("الفئة", index.filters.values("category"))
+        sources = st.multiselect("الملف", index.filters.values("source"))
+    filters = {}
+    if language in ("ar", "en"):
+        # سجلات الكتالوج بلا لغة، فتبقى ضمن أي لغة مختارة
+        filters["language"] = [language, ""]
+    if categories:
+        filters["category"] = categories
+    if sources:
+        filters["source"] = sources
+    return filters, language == "كل اللغات"
+
+def answer_from_index(index, user_q, timer, tenant, filters=None, all_languages=False):
+    # الإجابات المحفوظة لا تعرف التصفية التي بُنيت عليها، فلا تُستخدم مع تصفية يدوية
+    use_cache = not filters and not all_languages
+    cached, query_vector = lookup_cached_answer(index, user_q, timer, tenant, use_cache)
+    st.markdown("### ✨ الإجابة")
+    answer_box = st.empty()
+    if cached is not None:
+        answer, sources, similarity = cached
+        answer_box.write(answer)
+        st.caption(f"⚡ إجابة محفوظة لسؤال مشابه (تشابه {similarity:.2f})")
+        show_sources(sources, timer)
+        return
+
+    qa_chain = get_qa_chain(index, filters, all_languages)
+    with st.spinner("جارٍ البحث في بيانات الشركة..."):
+        sources, prompt = qa_chain.prepare(user_q, timer)
+    # المصادر تظهر فور انتهاء الاسترجاع، ثم تُكتب الإجابة أثناء توليدها
+    show_sources(sources, timer)
+    with answer_box.container():
+        answer = st.write_stream(qa_chain.generate(prompt, timer))
+    if query_vector is not None:
+        get_answer_cache(tenant).store(query_vector, manifest_version(index.manifest), answer, sources, user_q)
+
+def answer_warming_up(user_q, timer):
+    # وضع التهيئة: لا يوجد فهرس بعد، فيجيب النموذج مباشرة دون بيانات الشركة
+    timer.info["degraded"] = True
+    st.markdown("### ✨ الإجابة")
+    st.write_stream(RagChain(None, get_llm()).generate(user_q, timer))
+    st.caption("⏳ إجابة عامة: بيانات الشركة لم تُحمّل بعد.")
 
 # =========================
 # واجهة المستخدم
 # =========================
 st.title("🤖💼 نظام المساعد الذكي - بيانات الشركة")
 
+# المستأجر ثابت لكل نشر (RAG_TENANT) حتى لا تصل جلسات جهة إلى مستندات جهة أخرى.
+# مع RAG_TENANT_SELECTOR=1 فقط يُختار لكل جلسة من الرابط (?tenant=الاسم) أو من القائمة الجانبية
+app_config = IndexConfig.from_env()
+if app_config.tenant_selector:
+    tenants = list_tenants(app_config)
+    if st.session_state.get("tenant") not in tenants:
+        requested = st.query_params.get("tenant", DEFAULT_TENANT)
+        st.session_state["tenant"] = requested if requested in tenants else DEFAULT_TENANT
+    if len(tenants) > 1:
+        st.sidebar.selectbox("🏢 الجهة", tenants, key="tenant")
+else:
+    if app_config.tenant not in list_tenants(app_config):
+        st.error(f"⚠️ المستأجر {app_config.tenant} غير موجود: لا يوجد مجلد {app_config.tenants_dir}/{app_config.tenant}/data")
+        st.stop()
+    tenants = [app_config.tenant]
+    st.session_state["tenant"] = app_config.tenant
+tenant = st.session_state["tenant"]
+tenant_settings = tenant_config(IndexConfig.from_env(), tenant)
+
 tab1, tab2, tab3 = st.tabs(["🗨️ المحادثة", "📂 البيانات", "⚙️ الإعدادات"])
 
+# حالة بناء الفهرس في الخلفية؛ تتحدث كل ثانيتين وتعيد تشغيل الصفحة عند انتهاء البناء
+@st.fragment(run_every=2)
+def show_index_status(tenant):
+    status = get_index_service(tenant).status()
+    if status["state"] != "building":
+        st.rerun()
+    if status["files_total"]:
+        st.progress(
+            status["files_done"] / status["files_total"],
+            text=f"جارٍ الفهرسة: {status['files_done']}/{status['files_total']} ملف، {status['chunks_done']} مقطع",
+        )
+    else:
+        st.caption("⏳ جارٍ فحص ملفات البيانات...")
+
+index_status = get_index_service(tenant).status() if API_KEY else None
+if index_status and index_status["state"] == "building":
+    with tab2:
+        show_index_status(tenant)
+
 with tab1:
     st.header("💬 محادثة مع النظام")
     if API_KEY:
-        vectorstore = load_and_index_data()
-        qa_chain = get_qa_chain(vectorstore)
-
-        user_q = st.text_input("اكتب سؤالك هنا:", "")
-        if st.button("إرسال"):
-            if user_q:
-                with st.spinner("جارٍ المعالجة..."):
-                    result = qa_chain({"query": user_q})
-                    st.markdown("### ✨ الإجابة")
-                    st.write(result["result"])
-
-                    # إظهار المصادر
-                    with st.expander("📎 المصادر"):
-                        for doc in result["source_documents"]:
-                            st.write(doc.metadata.get("source", "غير معروف"))
-                            st.write(doc.page_content[:200] + "...")
+        index = get_index_service(tenant).current()
+        building = index_status["state"] == "building"
+        if index is None and not building:
+            if index_status["state"] == "failed":
+                st.error(f"⚠️ فشل بناء الفهرس: {index_status['error']}")
             else:
-                st.warning("⚠️ الرجاء إدخال سؤال.")
+                st.info("لا توجد ملفات مفهرسة بعد. أضف ملفات الشركة إلى مجلد data/.")
+        else:
+            if index is None:
+                st.warning("⏳ النظام قيد التهيئة: تُفهرس بيانات الشركة الآن، وحتى ينتهي ذلك تكون الإجابات عامة.")
+            elif building:
+                st.caption("🔄 يجري تحديث الفهرس في الخلفية؛ الإجابات الآن من النسخة السابقة.")
+
+            filters, all_languages = search_filters(index) if index is not None else ({}, False)
+            user_q = st.text_input("اكتب سؤالك هنا:", "")
+            if st.button("إرسال"):
+                if user_q:
+                    timer = RequestTimer()
+                    timer.info["tenant"] = tenant
+                    if index is None:
+                        answer_warming_up(user_q, timer)
+                    else:
+                        answer_from_index(index, user_q, timer, tenant, filters, all_languages)
+
+                    record = timer.finish()
+                    get_metrics_log().append(record)
+                    st.session_state["last_timings"] = record
+                else:
+                    st.warning("⚠️ الرجاء إدخال سؤال.")
     else:
         st.error("⚠️ النظام غير مهيأ. الرجاء إضافة API Key.")
 
 with tab2:
     st.header("📂 الملفات المفهرسة")
-    data_dir = "data"
+    data_dir = tenant_settings.data_dir
     if os.path.exists(data_dir):
         files = os.listdir(data_dir)
         if files:
             st.write("تم العثور على الملفات التالية:")
             for f in files:
                 st.write("📄", f)
+
+            manifest = read_manifest(tenant_settings.index_dir)
+            if manifest and manifest.get("last_update"):
+                last_update = manifest["last_update"]
+                st.caption(
+                    f"آخر تحديث للفهرس: {len(last_update['changed'])} ملف جديد/معدّل، "
+                    f"{len(last_update['removed'])} ملف محذوف."
+                )
+
+            dedup = manifest.get("dedup") if manifest else None
+            if dedup:
+                st.caption(
+                    f"إزالة التكرار: حُذف {dedup['chunks_dropped']} مقطع شبه مكرر من {dedup['chunks_total']} "
+                    f"({dedup['ratio']:.1%}) بعتبة تشابه {dedup['threshold']}."
+                )
+
+            # تقرير الدقة مقابل الزمن لفهرس البحث التقريبي مقارنة بالبحث الدقيق
+            ann = manifest.get("ann") if manifest else None
+            if ann and ann.get("report"):
+                report = ann["report"]
+                st.caption(
+                    f"نوع الفهرس: {ann['type']} — {report['ntotal']} مقطع، "
+                    f"البحث الدقيق {report['flat_ms_per_query']:.3f} ms لكل سؤال، recall@{report['k']}:"
+                )
+                st.table(report["sweep"])
+                if "index_bytes" in report:
+                    st.caption(
+                        f"ذاكرة فهرس البحث: {report['index_bytes'] / 2**20:.1f} MB مقابل "
+                        f"{report['flat_bytes'] / 2**20:.1f} MB للمتجهات الكاملة"
+                    )
         else:
-            st.info("لا توجد ملفات في مجلد data/.")
+            st.info(f"لا توجد ملفات في مجلد {data_dir}/.")
     else:
-        st.error("مجلد data/ غير موجود.")
+        st.error(f"مجلد {data_dir}/ غير موجود.")
 
 with tab3:
     st.header("⚙️ الإعدادات")
-    st.info("ضع ملفات الشركة في مجلد `data/`. سيتم تحديث الفهرسة تلقائيًا عند تشغيل النظام.")
+    st.info("ضع ملفات الشركة في مجلد `data/`. سيتم تحديث الفهرسة تلقائيًا عند تشغيل النظام إذا تغيّرت الملفات، وإلا يُحمّل الفهرس المحفوظ في مجلد `index/`.")
     st.code("export GEMINI_API_KEY='ضع_مفتاحك_هنا'")
+    st.write("لاستخدام تضمين محلي بدون اتصال بالشبكة (google | hashing | huggingface):")
+    st.code("export RAG_EMBEDDING_BACKEND=hashing")
+
+    # إعادة الفهرسة بعد إضافة ملفات دون إعادة تشغيل الخادم؛ الخدمة لا تتوقف أثناءها
+    if API_KEY and st.button("🔄 إعادة فهرسة البيانات"):
+        if get_index_service(tenant).start():
+            st.rerun()
+        st.info("الفهرسة جارية بالفعل.")
+
+    stats = get_answer_cache(tenant).stats()
+    st.caption(
+        f"ذاكرة الإجابات: {stats['entries']} إجابة محفوظة، "
+        f"{stats['hits']} إصابة / {stats['misses']} إخفاق (نسبة الإصابة {stats['hit_rate']:.0%})"
+    )
+    query_cache = get_tenant_indexes().embeddings.inner if API_KEY else None
+    if isinstance(query_cache, QueryEmbeddingCache):
+        stats = query_cache.stats()
+        st.caption(
+            f"ذاكرة متجهات الأسئلة: {stats['entries']} سؤال، "
+            f"{stats['hits']} إصابة / {stats['misses']} إخفاق (نسبة الإصابة {stats['hit_rate']:.0%})"
+        )
+    if API_KEY and len(tenants) > 1:
+        tenant_stats = get_tenant_indexes().stats()
+        st.caption(
+            f"الفهارس المحمّلة: {', '.join(tenant_stats['loaded'])} — "
+            f"{tenant_stats['memory_bytes'] / 2**20:.1f} / {tenant_stats['max_bytes'] / 2**20:.0f} MB، "
+            f"{tenant_stats['evictions']} إزالة"
+        )
+
+    # لوحة المشرف: زمن كل مرحلة في آخر طلب، والمئينات من ملف المقاييس
+    with st.expander("📊 لوحة المشرف: أزمنة مسار الطلب"):
+        last_timings = st.session_state.get("last_timings")
+        if last_timings:
+            st.write("آخر طلب (ms):")
+            st.table([{"stage": s, "ms": last_timings[s]} for s in STAGES if s in last_timings])
+            if "prompt_tokens" in last_timings:
+                st.caption(
+                    f"الرموز: السياق {last_timings['context_tokens']} / الطلب {last_timings['prompt_tokens']} — "
+                    f"{last_timings['chunks_packed']} من {last_timings['chunks_retrieved']} مقطع مسترجع "
+                    f"({last_timings['chunks_merged']} مكرر أو متداخل دُمج)"
+                )
+            if "tokens_before_compression" in last_timings:
+                st.caption(
+                    f"ضغط السياق: {last_timings['tokens_before_compression']} ← "
+                    f"{last_timings['context_tokens']} رمز بعد اختيار الجمل ذات الصلة"
+                )
+            if "filter_candidates" in last_timings:
+                st.caption(f"مجال البحث بعد التصفية: {last_timings['filter_candidates']} مقطع")
+        summary = get_metrics_log().summary()
+        if summary:
+            st.write("المئينات p50 / p95 / p99 لكل الطلبات المسجلة:")
+            st.table(summary)
+        else:
+            st.info("لا توجد طلبات مسجلة بعد.")
@@ -0,0 +1,105 @@
+# مقارنة إعدادات التقطيع: عدد المقاطع، حجم الفهرس، الجمل المقطوعة، ونسبة إصابة الاسترجاع
+# الاستخدام: python bench_chunking.py [--settings recursive:1000:0:200,structured:1000:600:200] [--queries 100] [--k 3]
+# كل إعداد بصيغة chunker:chunk_size:chunk_size_ar:chunk_overlap (chunk_size_ar يُهمل مع recursive)
+
+import os
+import time
+import random
+import argparse
+
+import faiss
+from langchain_community.vectorstores import FAISS
+
+from rag_index import IndexConfig, scan_data_dir, get_loader, make_splitter
+from rag_chunking import page_units
+from rag_embeddings import normalize_text
+
+DEFAULT_SETTINGS = "recursive:1000:0:200,structured:1000:600:200,structured:800:500:150,structured:1200:800:200"
+SENTENCE_ENDINGS = (".", "!", "?", "؟", "۔", "|", ":")
+
+
+def load_pages(config):
+    pages = []
+    for file in scan_data_dir(config.data_dir):
+        pages.extend(get_loader(os.path.join(config.data_dir, file)).lazy_load())
+    return pages
+
+
+def sample_queries(pages, count, seed=0):
+    # أسئلة الاختبار: جمل كاملة من النصوص؛ الإصابة أن تظهر الجملة كاملة في أحد المقاطع المسترجعة
+    sentences = []
+    for page in pages:
+        if "record" in page.metadata:
+            continue
+        text = page.page_content
+        sentences.extend(text[s:e] for kind, s, e in page_units(text) if kind == "sentence" and e - s >= 30)
+    random.Random(seed).shuffle(sentences)
+    return sentences[:count]
+
+
+def bench_setting(setting, pages, queries, k):
+    chunker, chunk_size, chunk_size_ar, chunk_overlap = setting.split(":")
+    config = IndexConfig.from_env()
+    config.chunker = chunker
+    config.chunk_size = int(chunk_size)
+    config.chunk_size_ar = int(chunk_size_ar) or config.chunk_size_ar
+    config.chunk_overlap = int(chunk_overlap)
+    embeddings = config.make_embeddings()
+
+    t = time.perf_counter()
+    chunks = make_splitter(config).split_documents(pages)
+    split_s = time.perf_counter() - t
+    texts = [c.page_content for c in chunks]
+    t = time.perf_counter()
+    store = FAISS.from_embeddings(list(zip(texts, embeddings.embed_documents(texts))), embeddings)
+    index_s = time.perf_counter() - t
+
+    prose = [c.page_content.rstrip() for c in chunks if "record" not in c.metadata]
+    cut = sum(1 for text in prose if not text.endswith(SENTENCE_ENDINGS))
+    hits = 0
+    for query in queries:
+        needle = normalize_text(query)
+        if any(needle in normalize_text(doc.page_content) for doc in store.similarity_search(query, k=k)):
+            hits += 1
+
+    return {
+        "setting": setting,
+        "chunks": len(chunks),
+        "avg_chars": sum(map(len, texts)) / len(texts) if texts else 0,
+        "cut": cut / len(prose) if prose else 0.0,
+        "index_kb": (faiss.serialize_index(store.index).nbytes + sum(len(t.encode("utf-8")) for t in texts)) / 1024,
+        "split_s": split_s,
+        "index_s": index_s,
+        "hit_rate": hits / len(queries) if queries else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--settings", default=DEFAULT_SETTINGS)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=3)
+    args = parser.parse_args()
+
+    config = IndexConfig.from_env()
+    pages = load_pages(config)
+    if not pages:
+        print("⚠️ لا توجد ملفات في مجلد البيانات.")
+        return
+    queries = sample_queries(pages, args.queries)
+
+    print(f"{len(pages)} صفحة، {len(queries)} سؤال، مزود التضمين: {config.embedding_backend}")
+    print(
+        f"{'setting':<32}{'chunks':>8}{'avg chars':>11}{'mid-cut':>9}{'index KB':>10}"
+        f"{'split s':>9}{'index s':>9}{f'hit@{args.k}':>8}"
+    )
+    for setting in args.settings.split(","):
+        r = bench_setting(setting.strip(), pages, queries, args.k)
+        print(
+            f"{r['setting']:<32}{r['chunks']:>8}{r['avg_chars']:>11.0f}{r['cut']:>9.1%}{r['index_kb']:>10.1f}"
+            f"{r['split_s']:>9.3f}{r['index_s']:>9.3f}{r['hit_rate']:>8.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
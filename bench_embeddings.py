@@ -0,0 +1,74 @@
+# مقارنة زمن التضمين والبحث بين مزودات التضمين المختلفة
+# الاستخدام: python bench_embeddings.py [--backends hashing,google] [--queries 50]
+
+import os
+import time
+import argparse
+import statistics
+
+from langchain_community.vectorstores import FAISS
+
+from rag_index import IndexConfig, scan_data_dir, load_chunks
+from rag_metrics import percentile
+
+
+def bench_backend(backend, chunks, queries):
+    config = IndexConfig.from_env()
+    config.embedding_backend = backend
+    embeddings = config.make_embeddings()
+    texts = [c.page_content for c in chunks]
+
+    t = time.perf_counter()
+    vectors = embeddings.embed_documents(texts)
+    index_time = time.perf_counter() - t
+    store = FAISS.from_embeddings(list(zip(texts, vectors)), embeddings)
+
+    embed_times, search_times = [], []
+    for q in queries:
+        t = time.perf_counter()
+        vector = embeddings.embed_query(q)
+        embed_times.append((time.perf_counter() - t) * 1000)
+        t = time.perf_counter()
+        store.similarity_search_by_vector(vector, k=3)
+        search_times.append((time.perf_counter() - t) * 1000)
+
+    return {
+        "backend": backend,
+        "dim": len(vectors[0]),
+        "index_s": index_time,
+        "embed_p50": statistics.median(embed_times),
+        "embed_p95": percentile(embed_times, 95),
+        "search_p50": statistics.median(search_times),
+        "search_p95": percentile(search_times, 95),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    default_backends = "hashing,google" if os.getenv("GEMINI_API_KEY") else "hashing"
+    parser.add_argument("--backends", default=default_backends)
+    parser.add_argument("--queries", type=int, default=50)
+    args = parser.parse_args()
+
+    config = IndexConfig.from_env()
+    chunks = []
+    for file in scan_data_dir(config.data_dir):
+        chunks.extend(load_chunks(config, file))
+    if not chunks:
+        print("⚠️ لا توجد ملفات في مجلد البيانات.")
+        return
+    # أسئلة الاختبار: بدايات المقاطع نفسها حتى لا نحتاج مجموعة أسئلة خارجية
+    queries = [chunks[i % len(chunks)].page_content[:80] for i in range(args.queries)]
+
+    print(f"{len(chunks)} مقطع، {len(queries)} سؤال")
+    print(f"{'backend':<12}{'dim':>6}{'index s':>10}{'embed p50':>11}{'embed p95':>11}{'search p50':>12}{'search p95':>12}")
+    for backend in args.backends.split(","):
+        r = bench_backend(backend.strip(), chunks, queries)
+        print(
+            f"{r['backend']:<12}{r['dim']:>6}{r['index_s']:>10.3f}"
+            f"{r['embed_p50']:>9.2f}ms{r['embed_p95']:>9.2f}ms{r['search_p50']:>10.3f}ms{r['search_p95']:>10.3f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# مقارنة البحث المسطح في كل المقاطع بالاسترجاع الهرمي (مراكز الملفات ← مقاطع أقربها) على مجموعة اصطناعية كبيرة
+# الاستخدام: python bench_hierarchical.py [--docs 2000] [--chunks-per-doc 50] [--dim 256] [--topics 40]
+#     [--queries 300] [--k 5] [--documents-k 3,5,10,20] [--index flat,hnsw]
+# الملفات تتشارك مواضيع فتتداخل مقاطعها كما في مجموعة حقيقية؛ كل سؤال مقطع من ملف مع ضجيج.
+# recall@k: نسبة نتائج البحث المسطح الدقيق التي يجدها الاسترجاع الهرمي
+# same-doc: نسبة النتائج القادمة من ملف السؤال نفسه (مقياس للضجيج في النتائج)
+
+import time
+import argparse
+
+import faiss
+import numpy as np
+
+from rag_ann import build_ann_index, set_search_params
+from rag_retrieval import DocumentIndex, filtered_index_search
+
+
+def make_corpus(docs, chunks_per_doc, dim, topics, seed=0):
+    rng = np.random.default_rng(seed)
+    topic_vectors = rng.standard_normal((topics, dim)).astype(np.float32)
+    centers = topic_vectors[rng.integers(0, topics, size=docs)] + 0.8 * rng.standard_normal((docs, dim)).astype(np.float32)
+    sizes = np.maximum(1, rng.poisson(chunks_per_doc, size=docs))
+    groups = np.repeat(np.arange(docs), sizes)
+    vectors = centers[groups] + 2.5 * rng.standard_normal((len(groups), dim)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors, groups
+
+
+def make_queries(vectors, groups, count, seed=1):
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(vectors), size=count, replace=False)
+    queries = vectors[picks] + 0.05 * rng.standard_normal((count, vectors.shape[1])).astype(np.float32)
+    faiss.normalize_L2(queries)
+    return queries, groups[picks]
+
+
+def run(search, queries):
+    results = []
+    t = time.perf_counter()
+    for i in range(len(queries)):
+        results.append(search(queries[i:i + 1]))
+    return results, (time.perf_counter() - t) * 1000 / len(queries)
+
+
+def scores(results, truth, groups, query_groups, k):
+    recall = np.mean([len(set(r) & set(t)) / k for r, t in zip(results, truth)])
+    same_doc = np.mean([np.mean(groups[r] == g) if len(r) else 0.0 for r, g in zip(results, query_groups)])
+    return recall, same_doc
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=2000)
+    parser.add_argument("--chunks-per-doc", type=int, default=50)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--topics", type=int, default=40)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--documents-k", default="3,5,10,20")
+    parser.add_argument("--index", default="flat,hnsw")
+    args = parser.parse_args()
+
+    vectors, groups = make_corpus(args.docs, args.chunks_per_doc, args.dim, args.topics)
+    queries, query_groups = make_queries(vectors, groups, args.queries)
+    t = time.perf_counter()
+    documents = DocumentIndex.from_vectors(vectors, groups)
+    summary_s = time.perf_counter() - t
+    print(f"{args.docs} ملف، {len(vectors)} مقطع، البعد {args.dim}، {args.queries} سؤال؛ متجهات الملخص في {summary_s:.2f}s")
+
+    flat = faiss.IndexFlatL2(args.dim)
+    flat.add(vectors)
+    truth, _ = run(lambda q: flat.search(q, args.k)[1][0], queries)
+
+    print(f"{'index':<8}{'mode':<18}{'ms/query':>10}{f'recall@{args.k}':>11}{'same-doc':>10}{'searched':>10}")
+    for index_type in args.index.split(","):
+        index = flat if index_type == "flat" else build_ann_index(vectors, index_type)
+        set_search_params(index, ef_search=64, nprobe=16)
+
+        results, ms = run(lambda q: index.search(q, args.k)[1][0], queries)
+        recall, same_doc = scores(results, truth, groups, query_groups, args.k)
+        print(f"{index_type:<8}{'flat search':<18}{ms:>10.3f}{recall:>11.3f}{same_doc:>10.3f}{len(vectors):>10}")
+
+        for documents_k in map(int, args.documents_k.split(",")):
+            searched = []
+
+            def hierarchical(q):
+                selection = documents.select(q, documents_k)
+                searched.append(len(selection))
+                _, positions = filtered_index_search(index, q, min(args.k, len(selection)), selection)
+                return positions[0][positions[0] >= 0]
+
+            results, ms = run(hierarchical, queries)
+            recall, same_doc = scores(results, truth, groups, query_groups, args.k)
+            mode = f"hierarchical@{documents_k}"
+            print(f"{index_type:<8}{mode:<18}{ms:>10.3f}{recall:>11.3f}{same_doc:>10.3f}{np.mean(searched):>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+# تقييم جودة الاسترجاع وزمنه على مجموعة أسئلة مرجعية (golden set)
+# الاستخدام:
+#   python eval_retrieval.py [--golden eval/golden.jsonl] [--k 1,3,5]
+#       [--config "hnsw:RAG_INDEX_TYPE=hnsw" --config "dense:RAG_RETRIEVER_MODE=dense" ...]
+#       [--per-query] [--json eval/report.json]
+# كل سطر في golden: {"question": "...", "sources": ["اسم ملف في data/", ...]}
+# بدون --config يُقيّم الفهرس الحالي في index/ بإعدادات البيئة كما يبنيه التطبيق.
+# كل --config بصيغة NAME:KEY=VALUE,KEY=VALUE يُبنى فهرسه في eval/index/NAME (ويُحدّث تدريجيًا بين التشغيلات)
+
+import os
+import json
+import time
+import argparse
+from contextlib import contextmanager
+
+from rag_index import IndexConfig, load_or_build_index
+from rag_retrieval import make_retriever
+from rag_metrics import percentile
+
+
+def load_golden(path):
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".json"):
+            items = json.load(f)
+        else:
+            items = [json.loads(line) for line in f if line.strip()]
+    return [{"question": item["question"], "sources": [os.path.basename(s) for s in item["sources"]]} for item in items]
+
+
+def parse_config(spec):
+    # "NAME:KEY=VALUE,KEY=VALUE" ← (الاسم، {المتغير: القيمة})
+    name, _, assignments = spec.partition(":")
+    overrides = {}
+    for assignment in filter(None, assignments.split(",")):
+        key, _, value = assignment.partition("=")
+        overrides[key.strip()] = value.strip()
+    return name.strip(), overrides
+
+
+@contextmanager
+def env_overrides(overrides):
+    previous = {key: os.environ.get(key) for key in overrides}
+    os.environ.update(overrides)
+    try:
+        yield
+    finally:
+        for key, value in previous.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def source_ranking(docs):
+    # ترتيب الملفات حسب أول ظهور لمقاطعها في نتائج الاسترجاع
+    ranking = []
+    for doc in docs:
+        source = os.path.basename(doc.metadata.get("source", ""))
+        if source not in ranking:
+            ranking.append(source)
+    return ranking
+
+
+def evaluate(name, overrides, golden, ks, index_root):
+    with env_overrides(overrides):
+        config = IndexConfig.from_env()
+    if overrides and "RAG_INDEX_DIR" not in overrides:
+        config.index_dir = os.path.join(index_root, name)
+    # نقيّم قائمة المرشحين المرتبة نفسها، قبل تعبئة السياق بميزانية الرموز
+    config.context_token_budget = 0
+    config.retriever_k = max(ks)
+
+    t = time.perf_counter()
+    index = load_or_build_index(config, config.make_embeddings())
+    build_s = time.perf_counter() - t
+    if index is None:
+        raise SystemExit(f"⚠️ لا توجد ملفات مفهرسة في {config.data_dir}")
+    retriever = make_retriever(index, config)
+
+    per_query = []
+    for item in golden:
+        t = time.perf_counter()
+        docs = retriever.invoke(item["question"])
+        ms = (time.perf_counter() - t) * 1000
+        ranking = source_ranking(docs)
+        expected = set(item["sources"])
+        first = next((rank for rank, source in enumerate(ranking, 1) if source in expected), None)
+        per_query.append({
+            "question": item["question"],
+            "ms": ms,
+            "first_relevant_rank": first,
+            "ranking": ranking,
+            # تُحسب على مستوى الملفات: كم من الملفات المتوقعة ظهر ضمن أول k ملف
+            **{f"recall@{k}": len(expected & set(ranking[:k])) / len(expected) for k in ks},
+        })
+
+    latencies = [q["ms"] for q in per_query]
+    summary = {
+        "config": name,
+        "index_type": index.manifest.get("ann", {}).get("type", "flat"),
+        "chunks": index.vectorstore.index.ntotal,
+        "build_s": build_s,
+        "mrr": sum(1 / q["first_relevant_rank"] for q in per_query if q["first_relevant_rank"]) / len(per_query),
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "max_ms": max(latencies),
+        **{f"recall@{k}": sum(q[f"recall@{k}"] for q in per_query) / len(per_query) for k in ks},
+    }
+    return summary, per_query
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--golden", default="eval/golden.jsonl")
+    parser.add_argument("--k", default="1,3,5")
+    parser.add_argument("--config", action="append", default=[])
+    parser.add_argument("--index-root", default="eval/index")
+    parser.add_argument("--per-query", action="store_true")
+    parser.add_argument("--json")
+    args = parser.parse_args()
+
+    ks = sorted({int(k) for k in args.k.split(",")})
+    golden = load_golden(args.golden)
+    configs = [parse_config(spec) for spec in args.config] or [("current", {})]
+    print(f"{len(golden)} سؤال، {len(configs)} إعداد")
+
+    results = []
+    for name, overrides in configs:
+        summary, per_query = evaluate(name, overrides, golden, ks, args.index_root)
+        results.append({"summary": summary, "overrides": overrides, "queries": per_query})
+        if args.per_query:
+            print(f"\n[{name}]")
+            for q in per_query:
+                rank = q["first_relevant_rank"] or "-"
+                print(f"  {rank!s:>3} {q['ms']:>8.2f}ms  {q['question'][:60]}")
+
+    header = f"{'config':<16}{'index':>7}{'chunks':>8}" + "".join(f"{f'R@{k}':>7}" for k in ks)
+    print("\n" + header + f"{'MRR':>7}{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}{'build s':>9}")
+    for result in results:
+        s = result["summary"]
+        print(
+            f"{s['config']:<16}{s['index_type']:>7}{s['chunks']:>8}"
+            + "".join(f"{s[f'recall@{k}']:>7.3f}" for k in ks)
+            + f"{s['mrr']:>7.3f}{s['p50_ms']:>9.2f}{s['p95_ms']:>9.2f}{s['max_ms']:>9.2f}{s['build_s']:>9.2f}"
+        )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
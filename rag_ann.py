@@ -0,0 +1,212 @@
+import time
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "hnsw", "ivfpq", "binary", "int8", "auto")
+# رموز مضغوطة في الذاكرة + إعادة ترتيب بالمتجهات الكاملة من الفهرس المسطح على القرص
+QUANTIZED_TYPES = ("binary", "int8")
+# تدريب PQ يحتاج 39 نقطة على الأقل لكل مركز: 2^4 مراكز كحد أدنى، و2^8 من نحو 10 آلاف متجه
+PQ_POINTS_PER_CENTROID = 39
+PQ_MIN_NBITS = 4
+PQ_MAX_NBITS = 8
+
+
+# =========================
+# اختيار نوع الفهرس وبناؤه
+# =========================
+def resolve_index_type(index_type, ntotal, hnsw_min=20000, ivfpq_min=500000):
+    # auto: بحث دقيق للمجموعات الصغيرة، HNSW للمتوسطة، IVF-PQ عندما تصبح الذاكرة هي القيد
+    if index_type == "auto":
+        if ntotal < hnsw_min:
+            return "flat"
+        if ntotal < ivfpq_min:
+            return "hnsw"
+        return "ivfpq"
+    if index_type == "ivfpq" and pq_nbits(ntotal) is None:
+        # مجموعة أصغر من أن يُدرّب عليها PQ؛ البحث الدقيق أسرع وأدق عند هذا الحجم
+        print(f"⚠️ {ntotal} مقطع لا تكفي لتدريب IVF-PQ، سيُستخدم الفهرس المسطح")
+        return "flat"
+    return index_type
+
+
+def pq_nbits(n):
+    # أكبر عدد بتات لكل رمز PQ يكفي n لتدريب مراكزه، أو None إن كان n أصغر من الحد الأدنى
+    for nbits in range(PQ_MAX_NBITS, PQ_MIN_NBITS - 1, -1):
+        if n >= PQ_POINTS_PER_CENTROID * 2 ** nbits:
+            return nbits
+    return None
+
+
+def pq_subquantizers(d):
+    # أكبر عدد من المقاطع الفرعية يقسم البعد بحيث يبقى لكل مقطع 8 أبعاد على الأقل
+    for m in range(max(1, d // 8), 0, -1):
+        if d % m == 0:
+            return m
+    return 1
+
+
+def binary_codes(vectors):
+    # بت الإشارة لكل بُعد، كل 8 أبعاد في بايت (d / 8 بايت للمتجه بدل 4d)
+    return np.packbits(vectors > 0, axis=1)
+
+
+def build_ann_index(vectors, index_type, hnsw_m=32, ef_construction=200, train_size=100000, seed=0):
+    # لـ binary و int8 يعيد فهرس الرموز فقط؛ يُغلف بـ QuantizedIndex مع الفهرس المسطح للبحث
+    n, d = vectors.shape
+    if index_type == "binary":
+        if d % 8:
+            raise ValueError(f"الفهرس الثنائي يتطلب بعدًا من مضاعفات 8 (البعد الحالي {d})")
+        index = faiss.IndexBinaryFlat(d)
+        index.add(binary_codes(vectors))
+        return index
+
+    if index_type == "int8":
+        # بايت لكل بعد بين أدنى وأعلى قيمة لذلك البعد في عينة التدريب
+        index = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_8bit)
+        rng = np.random.default_rng(seed)
+        index.train(vectors[rng.choice(n, size=min(n, train_size), replace=False)])
+        index.add(vectors)
+        return index
+
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(d, hnsw_m)
+        index.hnsw.efConstruction = ef_construction
+        index.add(vectors)
+        return index
+
+    if index_type == "ivfpq":
+        nbits = pq_nbits(n)
+        if nbits is None:
+            raise ValueError(f"عدد المتجهات ({n}) أقل من أن يُدرّب عليه IVF-PQ")
+        nlist = max(1, min(int(4 * np.sqrt(n)), n // PQ_POINTS_PER_CENTROID))
+        quantizer = faiss.IndexFlatL2(d)
+        # مجموعات أقل من ~10 آلاف متجه: رموز PQ أقصر (nbits < 8) حتى يكفيها التدريب
+        index = faiss.IndexIVFPQ(quantizer, d, nlist, pq_subquantizers(d), nbits)
+        # التدريب على عينة عشوائية يكفي لتعلّم المراكز وجداول الترميز
+        rng = np.random.default_rng(seed)
+        sample = vectors[rng.choice(n, size=min(n, train_size), replace=False)]
+        index.train(sample)
+        index.add(vectors)
+        return index
+
+    raise ValueError(f"نوع فهرس غير معروف: {index_type} (المتاح: {', '.join(INDEX_TYPES)})")
+
+
+class QuantizedIndex:
+    # مسح سريع على الرموز المضغوطة في الذاكرة (binary: مسافة Hamming على بت الإشارة؛
+    # int8: مسافة L2 على البايتات)، ثم إعادة ترتيب أفضل k * rerank مرشحًا بالمتجهات
+    # الكاملة من الفهرس المسطح. الفهرس المسطح مفتوح بـ mmap فلا تُقرأ إلا صفحات المرشحين.
+    # يوفر search و ntotal و d كفهرس FAISS عادي، فيعمل مع مخزن langchain كما هو
+    def __init__(self, codes, flat_index, rerank=10):
+        self.codes = codes
+        self.flat_index = flat_index
+        self.rerank = rerank
+        self.d = flat_index.d
+
+    @property
+    def ntotal(self):
+        return self.codes.ntotal
+
+    def code_bytes(self):
+        return self.codes.ntotal * (self.codes.code_size if isinstance(self.codes, faiss.IndexBinary) else self.codes.sa_code_size())
+
+    def search(self, vectors, k, params=None):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        encoded = binary_codes(vectors) if isinstance(self.codes, faiss.IndexBinary) else vectors
+        _, candidates = self.codes.search(encoded, min(self.ntotal, k * max(1, self.rerank)), params=params)
+        distances = np.full((len(vectors), k), np.finfo(np.float32).max, dtype=np.float32)
+        labels = np.full((len(vectors), k), -1, dtype=np.int64)
+        for i, row in enumerate(candidates):
+            row = row[row >= 0]
+            if not len(row):
+                continue
+            found_d, found = faiss.knn(vectors[i:i + 1], self.flat_index.reconstruct_batch(row), min(k, len(row)))
+            distances[i, :found.shape[1]] = found_d[0]
+            labels[i, :found.shape[1]] = row[found[0]]
+        return distances, labels
+
+
+def add_to_ann_index(index, vectors):
+    # تحديث بالإضافة فقط: المتجهات الجديدة تُضاف للفهرس المبني (binary برموزها)؛
+    # مراكز IVF-PQ ونطاقات int8 تبقى من آخر بناء كامل
+    if isinstance(index, QuantizedIndex):
+        index = index.codes
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    index.add(binary_codes(vectors) if isinstance(index, faiss.IndexBinary) else vectors)
+
+
+def write_ann_index(index, path):
+    if isinstance(index, QuantizedIndex):
+        index = index.codes
+    if isinstance(index, faiss.IndexBinary):
+        faiss.write_index_binary(index, path)
+    else:
+        faiss.write_index(index, path)
+
+
+def set_search_params(index, nprobe=None, ef_search=None, rerank=None):
+    if isinstance(index, QuantizedIndex):
+        if rerank is not None:
+            index.rerank = rerank
+        return
+    params = faiss.ParameterSpace()
+    if nprobe is not None and isinstance(index, faiss.IndexIVF):
+        params.set_index_parameter(index, "nprobe", nprobe)
+    if ef_search is not None and isinstance(index, faiss.IndexHNSW):
+        params.set_index_parameter(index, "efSearch", ef_search)
+
+
+def flat_vectors(flat_index):
+    return flat_index.reconstruct_n(0, flat_index.ntotal)
+
+
+# =========================
+# تقرير الدقة مقابل الزمن
+# =========================
+def timed_search(index, queries, k):
+    t = time.perf_counter()
+    _, ids = index.search(queries, k)
+    return ids, (time.perf_counter() - t) * 1000 / len(queries)
+
+
+def recall_report(flat_index, ann_index, vectors, index_type, k=10, queries=200, seed=0):
+    # لا توجد أسئلة حقيقية وقت البناء، فنستخدم متجهات مخزنة مع ضجيج بسيط كأسئلة تقريبية
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.choice(len(vectors), size=min(queries, len(vectors)), replace=False)]
+    noise = rng.standard_normal(sample.shape).astype(np.float32) * float(np.std(sample)) * 0.1
+    sample = np.ascontiguousarray(sample + noise)
+    k = min(k, len(vectors))
+
+    truth, flat_ms = timed_search(flat_index, sample, k)
+    if index_type == "hnsw":
+        knob, option, values = "efSearch", "ef_search", [16, 32, 64, 128, 256]
+    elif index_type in QUANTIZED_TYPES:
+        # rerank=1: ترتيب الرموز المضغوطة وحدها دون إعادة ترتيب فعلية
+        knob, option, values = "rerank", "rerank", [1, 2, 5, 10, 20, 50]
+    else:
+        knob, option, values = "nprobe", "nprobe", [1, 4, 8, 16, 32, 64]
+
+    rows = []
+    for value in values:
+        set_search_params(ann_index, **{option: value})
+        found, ann_ms = timed_search(ann_index, sample, k)
+        hits = sum(len(set(t) & set(f)) for t, f in zip(truth, found))
+        rows.append({knob: value, "recall": hits / truth.size, "ms_per_query": ann_ms})
+
+    # الذاكرة: ما يبقى مقيمًا للبحث مقابل المتجهات الكاملة (float32)
+    if isinstance(ann_index, QuantizedIndex):
+        index_bytes = ann_index.code_bytes()
+    else:
+        index_bytes = int(faiss.serialize_index(ann_index).nbytes)
+
+    return {
+        "index_type": index_type,
+        "ntotal": int(flat_index.ntotal),
+        "k": k,
+        "queries": len(sample),
+        "flat_ms_per_query": flat_ms,
+        "index_bytes": index_bytes,
+        "flat_bytes": int(flat_index.ntotal) * flat_index.d * 4,
+        "sweep": rows,
+    }
@@ -0,0 +1,150 @@
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from rag_embeddings import normalize_text
+from rag_retrieval import tokenize
+
+
+# =========================
+# ذاكرة الإجابات الدلالية
+# =========================
+def query_anchors(query):
+    # الكلمات التي تحوي أرقامًا (أرقام الطرازات والكميات)، والأرقام العربية الهندية بصيغة 0-9
+    return frozenset(
+        "".join(str(unicodedata.digit(c)) if c.isdigit() else c for c in token)
+        for token in tokenize(query)
+        if any(c.isdigit() for c in token)
+    )
+
+
+class SemanticAnswerCache:
+    # مفتاح الإجابة هو متجه السؤال: أي سؤال جديد بتشابه جيب تمام >= threshold مع سؤال
+    # مخزن يعيد نفس الإجابة والمصادر، بشرط تطابق أرقامه وطرازاته: "Powerwall 2" و"Powerwall 3"
+    # متشابهان جدًا في التضمين لكن إجابتيهما مختلفتان. تُفرغ الذاكرة كلها عند تغيّر إصدار الفهرس
+    def __init__(self, threshold=0.95, ttl=24 * 3600, max_entries=1000):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.version = None
+        self.next_key = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def check_version(self, version):
+        if version != self.version:
+            self.entries.clear()
+            self.version = version
+
+    def lookup(self, vector, version, query):
+        # يعيد (الإجابة، المصادر، التشابه) أو None
+        with self.lock:
+            self.check_version(version)
+            now = time.time()
+            for key in [k for k, e in self.entries.items() if now - e["created"] > self.ttl]:
+                del self.entries[key]
+            if not self.entries:
+                self.misses += 1
+                return None
+
+            keys = list(self.entries)
+            matrix = np.stack([self.entries[k]["vector"] for k in keys])
+            scores = matrix @ self.normalize(vector)
+            anchors = query_anchors(query)
+            for i, key in enumerate(keys):
+                if self.entries[key]["anchors"] != anchors:
+                    scores[i] = -1.0
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            entry = self.entries[keys[best]]
+            self.entries.move_to_end(keys[best])
+            return entry["answer"], entry["sources"], float(scores[best])
+
+    def store(self, vector, version, answer, sources, query):
+        with self.lock:
+            self.check_version(version)
+            self.entries[self.next_key] = {
+                "vector": self.normalize(vector),
+                "query": normalize_text(query),
+                "anchors": query_anchors(query),
+                "answer": answer,
+                "sources": sources,
+                "created": time.time(),
+            }
+            self.next_key += 1
+            # إزالة الأقدم استخدامًا (LRU)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+# =========================
+# ذاكرة متجهات الأسئلة
+# =========================
+class QueryEmbeddingCache(Embeddings):
+    # يغلف مزود التضمين: نص السؤال بعد التوحيد ← متجهه (LRU). نفس السؤال يتكرر كثيرًا
+    # حتى لو اختلفت إجابته، وكل تكرار كان استدعاءً للشبكة قبل بحث FAISS.
+    # تضمين المستندات يمر كما هو (له ذاكرته الخاصة في SQLite)
+    def __init__(self, inner, max_entries=1024):
+        self.inner = inner
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        return self.inner.embed_documents(texts)
+
+    def embed_query(self, text):
+        key = normalize_text(text)
+        with self.lock:
+            vector = self.entries.get(key)
+            if vector is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return list(vector)
+            self.misses += 1
+        # الاستدعاء خارج القفل حتى لا تنتظر الجلسات الأخرى الشبكة
+        vector = self.inner.embed_query(text)
+        with self.lock:
+            self.entries[key] = tuple(vector)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return vector
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
@@ -0,0 +1,86 @@
+import os
+import json
+
+from langchain_core.documents import Document
+from langchain_core.document_loaders import BaseLoader
+
+# أسماء الملفات المعروفة ← فئة موحدة تُستخدم في البيانات الوصفية
+CATALOG_CATEGORIES = {
+    "panels": "panel",
+    "inverters": "inverter",
+    "batteries": "battery",
+    "company_full_info": "company",
+}
+
+
+def catalog_category(name):
+    lowered = name.lower()
+    for keyword, category in (("panel", "panel"), ("inverter", "inverter"), ("batter", "battery")):
+        if keyword in lowered:
+            return category
+    return CATALOG_CATEGORIES.get(name, name)
+
+
+def is_scalar(value):
+    return not isinstance(value, (dict, list)) or (
+        isinstance(value, list) and all(not isinstance(v, (dict, list)) for v in value)
+    )
+
+
+def format_value(value):
+    return ", ".join(str(v) for v in value) if isinstance(value, list) else str(value)
+
+
+# =========================
+# تحويل السجلات إلى مستندات
+# =========================
+def iter_records(value, category, context=None, root=False):
+    # يعيد (الفئة، الحقول) لكل سجل. القاموس الذي يحوي قوائم سجلات فرعية (مثل products)
+    # يمرر حقوله البسيطة (مثل type) كسياق لأبنائه بدل أن يكون سجلًا مستقلًا
+    context = context or {}
+    if isinstance(value, list):
+        for item in value:
+            if isinstance(item, dict):
+                yield from iter_records(item, category, context)
+        return
+    if not isinstance(value, dict):
+        return
+
+    fields = {k: v for k, v in value.items() if is_scalar(v)}
+    nested = {k: v for k, v in value.items() if not is_scalar(v)}
+    has_children = any(isinstance(v, list) for v in nested.values())
+
+    if fields and (root or not has_children):
+        yield category, {**context, **fields}
+    child_context = {} if root else {**context, **fields}
+    for key, child in nested.items():
+        child_category = catalog_category(str(fields.get("type", key))) if not root else catalog_category(key)
+        yield from iter_records(child, child_category, child_context)
+
+
+def record_document(source, row, category, fields):
+    brand = fields.get("brand")
+    model = fields.get("model") or fields.get("models")
+    header = " ".join(format_value(v) for v in (brand, model) if v)
+    details = "; ".join(f"{k}: {format_value(v)}" for k, v in fields.items() if k not in ("brand", "model", "models"))
+    text = f"[{category}] {header} — {details}" if header else f"[{category}] {details}"
+
+    metadata = {"source": source, "category": category, "record": row}
+    if brand:
+        metadata["brand"] = format_value(brand)
+    if model:
+        metadata["model"] = format_value(model)
+    return Document(page_content=text, metadata=metadata)
+
+
+class CatalogJSONLoader(BaseLoader):
+    # كل سجل في الكتالوج يصبح مستندًا مختصرًا واحدًا مع الماركة والموديل والفئة
+    def __init__(self, file_path):
+        self.file_path = file_path
+
+    def lazy_load(self):
+        with open(self.file_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        stem = os.path.splitext(os.path.basename(self.file_path))[0]
+        for row, (category, fields) in enumerate(iter_records(data, catalog_category(stem), root=True)):
+            yield record_document(self.file_path, row, category, fields)
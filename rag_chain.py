@@ -0,0 +1,66 @@
+import time
+
+from langchain.chains.retrieval_qa.prompt import PROMPT
+
+from rag_metrics import RequestTimer
+
+
+# =========================
+# سلسلة الأسئلة والأجوبة بمراحل مقاسة
+# =========================
+class RagChain:
+    # نفس سلوك RetrievalQA بنمط "stuff" ونفس القالب، لكن بمراحل منفصلة حتى يمكن
+    # قياس كل مرحلة (ومنها زمن أول رمز من النموذج) على حدة
+    def __init__(self, retriever, llm, prompt=PROMPT, context_builder=None):
+        self.retriever = retriever
+        self.llm = llm
+        self.prompt = prompt
+        # بدون context_builder تُلصق كل المقاطع المسترجعة كما هي (سلوك RetrievalQA)
+        self.context_builder = context_builder
+
+    def __call__(self, inputs, timer=None):
+        return self.run(inputs["query"], timer=timer)
+
+    def run(self, query, timer=None):
+        timer = timer or RequestTimer()
+        docs, prompt = self.prepare(query, timer)
+        answer = "".join(self.generate(prompt, timer))
+        return {"query": query, "result": answer, "source_documents": docs}
+
+    def prepare(self, query, timer=None):
+        # الاسترجاع وبناء الطلب؛ يعيد (المصادر، نص الطلب) قبل استدعاء النموذج
+        # حتى تعرض الواجهة المصادر فور انتهاء الاسترجاع
+        timer = timer or RequestTimer()
+        with timer.activate():
+            embedding_before = timer.timings.get("query_embedding", 0.0)
+            t = time.perf_counter()
+            docs = self.retriever.invoke(query)
+            retrieval_ms = (time.perf_counter() - t) * 1000
+            # زمن البحث = زمن الاسترجاع ناقص تضمين السؤال الذي حدث داخله
+            timer.add("vector_search", retrieval_ms - (timer.timings.get("query_embedding", 0.0) - embedding_before))
+
+            with timer.stage("prompt_assembly"):
+                if self.context_builder is not None:
+                    docs, context, stats = self.context_builder.build(docs, query)
+                else:
+                    context, stats = "\n\n".join(doc.page_content for doc in docs), None
+                prompt = self.prompt.format(context=context, question=query)
+            if stats is not None:
+                # عدد الرموز لكل طلب يُسجل مع الأزمنة في ملف المقاييس
+                stats["prompt_tokens"] = self.context_builder.counter.count(prompt)
+                timer.info.update(stats)
+        return docs, prompt
+
+    def generate(self, prompt, timer=None):
+        # يعيد أجزاء الإجابة فور وصولها من النموذج (llm.stream)
+        timer = timer or RequestTimer()
+        first = True
+        t = time.perf_counter()
+        for chunk in self.llm.stream(prompt):
+            if first:
+                timer.add("llm_ttft", (time.perf_counter() - t) * 1000)
+                first = False
+            yield chunk.content
+        timer.add("llm_total", (time.perf_counter() - t) * 1000)
+        if first:
+            timer.add("llm_ttft", timer.timings["llm_total"])
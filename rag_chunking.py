@@ -0,0 +1,226 @@
+import re
+
+from langchain_core.documents import Document
+
+ARABIC_LETTERS = re.compile(r"[\u0621-\u064A\u066E-\u06D3\u06FA-\u06FF]")
+LATIN_LETTERS = re.compile(r"[A-Za-z]")
+# نهاية الجملة: . ! ? … والعلامات العربية ؟ (U+061F) و۔ (U+06D4) ثم مسافة
+SENTENCE_END = re.compile(r"(?<=[.!?\u061F\u06D4\u2026])[\"'\u00BB)\]]*\s+")
+# فواصل أضعف تُستخدم فقط لتقسيم جملة أطول من حجم المقطع: ؛ (U+061B) ، (U+060C) ; , :
+CLAUSE_END = re.compile(r"(?<=[\u061B\u060C;,:])\s+")
+HEADING_MARK = re.compile(r"^\s*#{1,6}\s+\S")
+TERMINAL_PUNCTUATION = ".!?\u061F\u06D4\u061B\u060C,;"
+
+
+def detect_language(text):
+    # "ar" إذا كانت أغلب الحروف عربية، وإلا "en"
+    arabic = len(ARABIC_LETTERS.findall(text))
+    latin = len(LATIN_LETTERS.findall(text))
+    return "ar" if arabic >= latin and arabic > 0 else "en"
+
+
+def is_table_row(line):
+    return line.count("|") >= 2 or line.count("\t") >= 2
+
+
+def is_heading(line, isolated):
+    # عنوان Markdown، أو سطر قصير ينتهي بنقطتين، أو سطر قصير منفصل بلا علامة ترقيم نهائية
+    stripped = line.strip()
+    if not stripped or len(stripped) > 80 or is_table_row(line):
+        return False
+    if HEADING_MARK.match(line) or stripped.endswith(":"):
+        return True
+    return isolated and len(stripped) <= 60 and stripped[-1] not in TERMINAL_PUNCTUATION
+
+
+# =========================
+# تقسيم الصفحة إلى وحدات بمواضعها
+# =========================
+def iter_lines(text):
+    # (بداية السطر، نهايته دون \n)
+    start = 0
+    for line in text.split("\n"):
+        yield start, start + len(line)
+        start += len(line) + 1
+
+
+def split_spans(text, start, end, pattern):
+    # يقسم text[start:end] عند pattern ويعيد مواضع الأجزاء غير الفارغة
+    spans, position = [], start
+    for match in pattern.finditer(text, start, end):
+        if match.start() > position:
+            spans.append((position, match.start()))
+        position = match.end()
+    if position < end:
+        spans.append((position, end))
+    return spans
+
+
+def page_units(text):
+    # يعيد قائمة (النوع، البداية، النهاية): heading | row | sentence | break
+    lines = list(iter_lines(text))
+    units = []
+    for i, (start, end) in enumerate(lines):
+        line = text[start:end]
+        if not line.strip():
+            if units and units[-1][0] != "break":
+                units.append(("break", start, end))
+            continue
+        isolated = all(
+            j < 0 or j >= len(lines) or not text[lines[j][0]:lines[j][1]].strip() for j in (i - 1, i + 1)
+        )
+        if is_table_row(line):
+            units.append(("row", start, end))
+        elif is_heading(line, isolated):
+            units.append(("heading", start, end))
+        else:
+            # كل سطر نصي ينتهي عنده جزء؛ كثير من الملفات العربية جملة في كل سطر
+            for s, e in split_spans(text, start, end, SENTENCE_END):
+                units.append(("sentence", s, e))
+    return units
+
+
+def split_long(text, start, end, limit):
+    # جملة أطول من المقطع: عند الفواصل، ثم عند المسافات، ثم قطع مباشر
+    if end - start <= limit:
+        return [(start, end)]
+    parts = []
+    for pattern in (CLAUSE_END, re.compile(r"\s+")):
+        pieces = split_spans(text, start, end, pattern)
+        if len(pieces) > 1:
+            current_start, current_end = pieces[0]
+            for s, e in pieces[1:]:
+                if e - current_start <= limit:
+                    current_end = e
+                else:
+                    parts.extend(split_long(text, current_start, current_end, limit))
+                    current_start, current_end = s, e
+            parts.extend(split_long(text, current_start, current_end, limit))
+            return parts
+    return [(s, min(s + limit, end)) for s in range(start, end, limit)]
+
+
+# =========================
+# مقسّم يراعي اللغة وبنية النص
+# =========================
+class StructuredTextSplitter:
+    # يجمع الجمل حتى حجم مستهدف لكل لغة (الحروف العربية تحمل رموزًا أكثر لكل حرف)،
+    # ولا يقطع جملة أو صف جدول في منتصفه. العنوان يبدأ مقطعًا جديدًا ويُحفظ في section،
+    # وصف رأس الجدول يتكرر في بداية المقاطع التالية من نفس الجدول.
+    # التداخل بجمل كاملة حتى نسبة chunk_overlap / chunk_size من الحجم المستهدف
+    def __init__(self, chunk_size=1000, chunk_size_ar=600, chunk_overlap=200):
+        self.sizes = {"en": chunk_size, "ar": chunk_size_ar}
+        self.overlap_ratio = chunk_overlap / chunk_size if chunk_size else 0.0
+
+    def split_documents(self, documents):
+        chunks = []
+        for doc in documents:
+            if "record" in doc.metadata:
+                # سجل الكتالوج وحدة كاملة مهما قصر أو طال؛ لا يُقسم ولا يُعامل سطره القصير كعنوان
+                chunks.append(Document(page_content=doc.page_content, metadata={**doc.metadata, "start_index": 0}))
+                continue
+            chunks.extend(self.split_page(doc.page_content, doc.metadata))
+        return chunks
+
+    def split_text(self, text):
+        return [chunk.page_content for chunk in self.split_page(text, {})]
+
+    def split_page(self, text, metadata):
+        # اللغة تُحدد لكل فقرة، فالصفحة المختلطة تأخذ حجمًا مناسبًا لكل جزء منها
+        units = []
+        paragraph = []
+
+        def close_paragraph():
+            if paragraph:
+                language = detect_language(text[paragraph[0][1]:paragraph[-1][2]])
+                for kind, start, end in paragraph:
+                    if kind == "sentence":
+                        units.extend(("sentence", s, e, language) for s, e in split_long(text, start, end, self.sizes[language]))
+                    else:
+                        units.append((kind, start, end, language))
+                paragraph.clear()
+
+        for kind, start, end in page_units(text):
+            if kind in ("break", "heading"):
+                close_paragraph()
+                units.append((kind, start, end, None))
+            else:
+                paragraph.append((kind, start, end))
+        close_paragraph()
+
+        chunks = []
+        current = []
+        section = None
+        table_header = None
+        # بداية كل صف جدول ← موضع رأس جدوله، لتكرار الرأس في المقاطع التالية
+        row_headers = {}
+
+        def flush(keep_overlap):
+            nonlocal current
+            body = [u for u in current if u[0] != "break"]
+            carried = []
+            if len(body) > 1 and body[-1][0] == "row" and row_headers.get(body[-1][1]) == body[-1][1:3]:
+                # رأس جدول في آخر المقطع يُنقل إلى بداية المقطع التالي مع صفوفه
+                carried = [body.pop()]
+            if not body:
+                current = carried
+                return
+            chunks.append(self.make_chunk(text, body, metadata, section, row_headers))
+            if keep_overlap and not carried:
+                overlap = int(self.sizes[body[-1][3]] * self.overlap_ratio)
+                size = 0
+                for unit in reversed(body):
+                    if unit[0] != "sentence" or size + unit[2] - unit[1] > overlap:
+                        break
+                    carried.insert(0, unit)
+                    size += unit[2] - unit[1]
+            current = carried
+
+        for unit in units:
+            kind, start, end, language = unit
+            if kind == "heading":
+                # العناوين المتتالية تنتظر معًا أول نص بعدها؛ لا يُحذف نص عنوان أبدًا: إن تجاوزت
+                # الحجم، أو انتهت الصفحة بعدها، تصبح مقطعًا مستقلًا
+                pending = current and all(u[0] in ("heading", "break") for u in current)
+                if pending and end - current[0][1] <= min(self.sizes.values()):
+                    current.append(unit)
+                else:
+                    flush(keep_overlap=False)
+                    current = [unit]
+                section = text[start:end].strip().lstrip("#").strip()
+                table_header = None
+                continue
+            if kind == "break":
+                if current:
+                    current.append(unit)
+                table_header = None
+                continue
+            if kind == "row":
+                table_header = table_header or (start, end)
+                row_headers[start] = table_header
+            else:
+                table_header = None
+
+            limit = self.sizes[next((u[3] for u in current if u[3]), language)]
+            if current and end - current[0][1] > limit:
+                flush(keep_overlap=kind == "sentence")
+            current.append(unit)
+        flush(keep_overlap=False)
+        return chunks
+
+    def make_chunk(self, text, units, metadata, section, row_headers):
+        start, end = units[0][1], units[-1][2]
+        content = text[start:end]
+        chunk_metadata = dict(metadata)
+        if "record" not in metadata:
+            # سجلات الكتالوج بلا لغة حتى لا تستبعدها تصفية البحث بلغة السؤال
+            chunk_metadata["language"] = detect_language(content)
+        if section:
+            chunk_metadata["section"] = section
+        header = row_headers.get(start) if units[0][0] == "row" else None
+        if header is not None and header[0] < start:
+            # تكرار رأس الجدول يجعل النص غير متصل في الصفحة، فلا يُسجل start_index
+            content = text[header[0]:header[1]] + "\n" + content
+        else:
+            chunk_metadata["start_index"] = start
+        return Document(page_content=content, metadata=chunk_metadata)
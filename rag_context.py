@@ -0,0 +1,286 @@
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.documents import Document
+
+from rag_chunking import page_units
+from rag_embeddings import normalize_text, embed_batch
+from rag_retrieval import tokenize
+
+# أقل تداخل (بالحروف) يُعتبر دليلًا على أن مقطعين متجاورين من نفس الصفحة
+MIN_TEXT_OVERLAP = 20
+
+
+# =========================
+# عدّ الرموز
+# =========================
+class TokenCounter:
+    # tiktoken تقريب لمقسّم Gemini وليس مطابقًا له، لكنه كافٍ لتحديد سقف الطلب.
+    # إن تعذر تحميل الترميز (مثلًا بدون شبكة عند أول تشغيل) نقدّر بعدد البايتات / 4
+    def __init__(self, encoding_name="cl100k_base"):
+        self.encoding_name = encoding_name
+        self.encoding = None
+        try:
+            import tiktoken
+
+            self.encoding = tiktoken.get_encoding(encoding_name)
+        except Exception as exc:
+            print(f"⚠️ تعذر تحميل ترميز tiktoken {encoding_name}، سيُستخدم تقدير تقريبي: {exc}")
+
+    def count(self, text):
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return math.ceil(len(text.encode("utf-8")) / 4)
+
+    def truncate(self, text, max_tokens):
+        if max_tokens <= 0:
+            return ""
+        if self.encoding is not None:
+            tokens = self.encoding.encode(text, disallowed_special=())
+            return self.encoding.decode(tokens[:max_tokens])
+        # التقدير بالبايتات: نقص الحروف حتى يدخل النص في الحد
+        while text and self.count(text) > max_tokens:
+            text = text[: max(0, len(text) - max(1, (self.count(text) - max_tokens) * 2))]
+        return text
+
+
+# =========================
+# دمج المقاطع المتداخلة
+# =========================
+def span_key(doc):
+    # كل سجل كتالوج صفحة مستقلة من نفس الملف (start_index=0 في كل سجل)، فرقم السجل جزء من المفتاح
+    return doc.metadata.get("source"), doc.metadata.get("page"), doc.metadata.get("record")
+
+
+def text_overlap(left, right, max_overlap):
+    # أطول جزء في نهاية left يساوي بداية right
+    for size in range(min(len(left), len(right), max_overlap), MIN_TEXT_OVERLAP - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def merge_texts(a, b, max_overlap):
+    # يعيد (النص المدمج، بداية المقطع المدمج) أو None إن لم يتداخل المقطعان
+    text_a, text_b = a.page_content, b.page_content
+    start_a, start_b = a.metadata.get("start_index"), b.metadata.get("start_index")
+    if start_a is not None and start_b is not None:
+        # مواضع المقاطع في الصفحة معروفة (add_start_index)
+        if start_b < start_a:
+            (text_a, start_a), (text_b, start_b) = (text_b, start_b), (text_a, start_a)
+        end_a = start_a + len(text_a)
+        if start_b > end_a:
+            return None
+        # المواضع وحدها لا تكفي: الجزء المشترك يجب أن يتطابق نصيًا، وإلا فهما من صفحتين مختلفتين
+        tail = text_a[start_b - start_a:]
+        shared = min(len(tail), len(text_b))
+        if tail[:shared] != text_b[:shared]:
+            return None
+        return text_a + text_b[end_a - start_b:], start_a
+
+    # فهارس قديمة بدون مواضع: نكتشف التداخل من النص نفسه
+    if text_b in text_a:
+        return text_a, start_a
+    if text_a in text_b:
+        return text_b, start_b
+    size = text_overlap(text_a, text_b, max_overlap)
+    if size:
+        return text_a + text_b[size:], start_a
+    size = text_overlap(text_b, text_a, max_overlap)
+    if size:
+        return text_b + text_a[size:], start_b
+    return None
+
+
+def merge_overlapping(docs, max_overlap=400):
+    # يحافظ على ترتيب الاسترجاع: المقطع المدمج يأخذ مرتبة أفضل الجزأين.
+    # النصوص المكررة حرفيًا من مصادر مختلفة تُحذف أيضًا
+    merged = []
+    seen_texts = set()
+    for doc in docs:
+        if doc.page_content in seen_texts:
+            continue
+        for i, other in enumerate(merged):
+            if span_key(other) != span_key(doc):
+                continue
+            result = merge_texts(other, doc, max_overlap)
+            if result is not None:
+                text, start = result
+                metadata = dict(other.metadata)
+                if start is not None:
+                    metadata["start_index"] = start
+                merged[i] = Document(page_content=text, metadata=metadata, id=other.id)
+                seen_texts.add(text)
+                break
+        else:
+            merged.append(doc)
+        seen_texts.add(doc.page_content)
+    return merged
+
+
+# =========================
+# ضغط السياق: الجمل ذات الصلة فقط
+# =========================
+def sentence_units(docs):
+    # (رقم المقطع، النوع، البداية، النهاية، رأس الجدول) لكل جملة أو صف أو عنوان
+    units = []
+    for i, doc in enumerate(docs):
+        header = None
+        for kind, start, end in page_units(doc.page_content):
+            if kind == "break":
+                header = None
+                continue
+            header = (header or (start, end)) if kind == "row" else None
+            units.append((i, kind, start, end, header if kind == "row" else None))
+    return units
+
+
+class ContextCompressor:
+    # يقيّم كل جملة في المقاطع المسترجعة مقابل السؤال: تطابق كلمات السؤال (موزونة بـ IDF
+    # بين الجمل المرشحة) + تشابه التضمين، ويبقي أعلى الجمل حتى keep_ratio من رموز السياق.
+    # الجمل تبقى بترتيبها في المقطع، وصف الجدول يأخذ معه رأس جدوله. مواضع الجمل المحفوظة
+    # تُسجل في spans للاستشهاد: مواضع في الصفحة إن عُرف start_index، وإلا مواضع داخل المقطع.
+    # متجهات الجمل تُحفظ في ذاكرة LRU لأن نفس المقاطع تتكرر في الأسئلة المتشابهة.
+    # limiter: محدد معدل مزود التضمين المشترك مع البناء، فتضمين الجمل لكل طلب ضمن نفس الحصة
+    def __init__(self, embeddings=None, keep_ratio=0.33, lexical_weight=0.5, min_tokens=200, max_entries=4096,
+                 limiter=None, batch_size=100, max_retries=5):
+        self.embeddings = embeddings
+        self.limiter = limiter
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.keep_ratio = keep_ratio
+        self.lexical_weight = lexical_weight if embeddings is not None else 1.0
+        self.min_tokens = min_tokens
+        self.max_entries = max_entries
+        self.vectors = OrderedDict()
+        self.lock = threading.Lock()
+
+    def embed(self, texts):
+        keys = [normalize_text(text) for text in texts]
+        with self.lock:
+            cached = {key: self.vectors[key] for key in keys if key in self.vectors}
+            for key in cached:
+                self.vectors.move_to_end(key)
+        missing = list(dict.fromkeys(key for key in keys if key not in cached))
+        if missing:
+            vectors = []
+            for i in range(0, len(missing), self.batch_size):
+                vectors.extend(embed_batch(self.embeddings, missing[i:i + self.batch_size], self.limiter, self.max_retries))
+            fresh = dict(zip(missing, np.asarray(vectors, dtype=np.float32)))
+            cached.update(fresh)
+            with self.lock:
+                self.vectors.update(fresh)
+                while len(self.vectors) > self.max_entries:
+                    self.vectors.popitem(last=False)
+        return np.stack([cached[key] for key in keys])
+
+    def scores(self, query, texts):
+        query_terms = set(tokenize(query))
+        unit_terms = [set(tokenize(text)) for text in texts]
+        lexical = np.zeros(len(texts), dtype=np.float32)
+        if query_terms:
+            idf = {term: math.log(1 + len(texts) / (1 + sum(term in terms for terms in unit_terms))) for term in query_terms}
+            total = sum(idf.values())
+            lexical = np.asarray([sum(idf[t] for t in query_terms & terms) / total for terms in unit_terms], dtype=np.float32)
+        if self.lexical_weight >= 1.0:
+            return lexical
+        vectors = self.embed(texts)
+        query_vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1) * max(float(np.linalg.norm(query_vector)), 1e-12)
+        semantic = np.clip(vectors @ query_vector / np.maximum(norms, 1e-12), 0.0, 1.0)
+        return self.lexical_weight * lexical + (1.0 - self.lexical_weight) * semantic
+
+    def compress(self, query, docs, counter):
+        units = sentence_units(docs)
+        texts = [docs[i].page_content[start:end] for i, _, start, end, _ in units]
+        tokens = [counter.count(text) for text in texts]
+        total = sum(tokens)
+        if not units or total < self.min_tokens:
+            return docs
+
+        kept, used = set(), 0
+        positions = {(unit[0], unit[2]): n for n, unit in enumerate(units)}
+        for n in np.argsort(-self.scores(query, texts), kind="stable"):
+            if used >= self.keep_ratio * total:
+                break
+            header = units[n][4]
+            for m in (positions.get((units[n][0], header[0])) if header else None, n):
+                if m is not None and m not in kept:
+                    kept.add(m)
+                    used += tokens[m]
+
+        compressed = []
+        for i, doc in enumerate(docs):
+            selected = [n for n in range(len(units)) if units[n][0] == i and n in kept]
+            if not selected:
+                continue
+            text = doc.page_content
+            # الجمل المتتالية تُنسخ متصلة كما في النص، والفجوات يُشار إليها بـ …
+            segments = []
+            for n in selected:
+                if segments and segments[-1][2] == n - 1:
+                    segments[-1][1], segments[-1][2] = units[n][3], n
+                else:
+                    segments.append([units[n][2], units[n][3], n])
+            parts = [text[start:end] for start, end, _ in segments]
+            offset = doc.metadata.get("start_index") or 0
+            metadata = {
+                **doc.metadata,
+                "compressed": True,
+                "spans": [(offset + start, offset + end) for start, end, _ in segments],
+            }
+            compressed.append(Document(page_content="\n…\n".join(parts), metadata=metadata, id=doc.id))
+        return compressed
+
+
+# =========================
+# تعبئة السياق حسب ميزانية الرموز
+# =========================
+class ContextBuilder:
+    # المقاطع تصل مرتبة من المسترجع؛ تُدمج المتداخلة (وتُضغط إلى جملها ذات الصلة إن وُجد
+    # compressor) ثم تُضاف بالترتيب حتى تمتلئ الميزانية. آخر مقطع لا يتسع يُقص إن بقي له
+    # min_fragment_tokens على الأقل
+    def __init__(self, token_budget=1500, encoding_name="cl100k_base", min_fragment_tokens=64, separator="\n\n",
+                 compressor=None):
+        self.token_budget = token_budget
+        self.min_fragment_tokens = min_fragment_tokens
+        self.separator = separator
+        self.counter = TokenCounter(encoding_name)
+        self.compressor = compressor
+
+    def build(self, docs, query=None):
+        # يعيد (المقاطع المختارة، نص السياق، إحصاءات الرموز)
+        candidates = merge_overlapping(docs)
+        merged_count = len(candidates)
+        tokens_before = None
+        if self.compressor is not None and query:
+            tokens_before = self.counter.count(self.separator.join(doc.page_content for doc in candidates))
+            candidates = self.compressor.compress(query, candidates, self.counter)
+        separator_tokens = self.counter.count(self.separator)
+        packed, used = [], 0
+        for doc in candidates:
+            tokens = self.counter.count(doc.page_content)
+            cost = tokens + (separator_tokens if packed else 0)
+            if self.token_budget <= 0 or used + cost <= self.token_budget:
+                packed.append(doc)
+                used += cost
+                continue
+            remaining = self.token_budget - used - (separator_tokens if packed else 0)
+            if remaining >= self.min_fragment_tokens:
+                text = self.counter.truncate(doc.page_content, remaining)
+                packed.append(Document(page_content=text, metadata={**doc.metadata, "truncated": True}, id=doc.id))
+                used += self.counter.count(text) + (separator_tokens if len(packed) > 1 else 0)
+            break
+
+        context = self.separator.join(doc.page_content for doc in packed)
+        stats = {
+            "chunks_retrieved": len(docs),
+            "chunks_merged": len(docs) - merged_count,
+            "chunks_packed": len(packed),
+            "context_tokens": self.counter.count(context),
+        }
+        if tokens_before is not None:
+            stats["tokens_before_compression"] = tokens_before
+        return packed, context, stats
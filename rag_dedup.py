@@ -0,0 +1,92 @@
+import zlib
+from collections import defaultdict
+
+import numpy as np
+
+from rag_embeddings import normalize_text
+
+# أكبر عدد أولي أقل من 2^31؛ يبقي (a * x + b) داخل uint64 دون فيض
+MERSENNE_PRIME = (1 << 31) - 1
+
+
+# =========================
+# بصمات MinHash
+# =========================
+def shingles(text, size=5):
+    # مقاطع حرفية متداخلة بعد توحيد المسافات؛ تعمل للعربية والإنجليزية بلا تقطيع كلمات
+    text = normalize_text(text).lower()
+    if len(text) <= size:
+        grams = {text}
+    else:
+        grams = {text[i:i + size] for i in range(len(text) - size + 1)}
+    return np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+
+
+def lsh_bands(threshold, num_perm):
+    # يختار (عدد الأشرطة، الصفوف لكل شريط) بحيث تكون عتبة منحنى LSH (1/b)^(1/r)
+    # أقل ما يمكن من threshold دون تجاوزها؛ المرشحون يُتحقق منهم بالتشابه المقدّر بعدها
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        if (1 / bands) ** (1 / rows) <= threshold:
+            best = (bands, rows)
+    return best
+
+
+class NearDuplicateFilter:
+    # يكشف المقاطع شبه المكررة (تشابه Jaccard >= threshold) بـ MinHash + LSH.
+    # المفاتيح هي معرّفات المقاطع في الفهرس، فيمكن حذفها عند حذف ملفها
+    def __init__(self, threshold=0.85, num_perm=128, shingle_size=5, seed=1):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, MERSENNE_PRIME, size=num_perm).astype(np.uint64)
+        self.b = rng.randint(0, MERSENNE_PRIME, size=num_perm).astype(np.uint64)
+        self.bands, self.rows = lsh_bands(threshold, num_perm)
+        self.signatures = {}
+        self.buckets = [defaultdict(set) for _ in range(self.bands)]
+
+    def signature(self, text):
+        values = shingles(text, self.shingle_size) % MERSENNE_PRIME
+        hashed = (np.outer(values, self.a) + self.b) % MERSENNE_PRIME
+        return hashed.min(axis=0).astype(np.uint32)
+
+    def band_keys(self, signature):
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def find(self, text, signature=None):
+        # يعيد مفتاح أقرب مقطع مخزن يتجاوز العتبة، أو None
+        signature = self.signature(text) if signature is None else signature
+        candidates = set()
+        for bucket, key in zip(self.buckets, self.band_keys(signature)):
+            candidates.update(bucket.get(key, ()))
+        best, best_score = None, self.threshold
+        for candidate in candidates:
+            score = float(np.mean(self.signatures[candidate] == signature))
+            if score >= best_score:
+                best, best_score = candidate, score
+        return best
+
+    def add(self, key, text, signature=None):
+        signature = self.signature(text) if signature is None else signature
+        self.signatures[key] = signature
+        for bucket, band_key in zip(self.buckets, self.band_keys(signature)):
+            bucket[band_key].add(key)
+
+    def remove(self, keys):
+        for key in keys:
+            signature = self.signatures.pop(key, None)
+            if signature is None:
+                continue
+            for bucket, band_key in zip(self.buckets, self.band_keys(signature)):
+                members = bucket.get(band_key)
+                if members is not None:
+                    members.discard(key)
+                    if not members:
+                        del bucket[band_key]
+
+    def __len__(self):
+        return len(self.signatures)
@@ -0,0 +1,258 @@
+import os
+import re
+import time
+import random
+import sqlite3
+import hashlib
+import threading
+import zlib
+import unicodedata
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+# =========================
+# محدد المعدل (Token Bucket)
+# =========================
+class TokenBucket:
+    # rate: عدد الطلبات المسموح بها في الثانية، capacity: أقصى دفعة فورية
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, int(rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, n=1):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return
+                wait = (n - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+_shared_limiters = {}
+_shared_limiters_lock = threading.Lock()
+
+
+def shared_limiter(rpm, capacity):
+    # محدد واحد لكل حصة داخل العملية: كل دفعات البناء (وبناء كل المستأجرين) تسحب من
+    # نفس الرصيد، فلا يبدأ كل استدعاء لـ embed_texts برصيد ممتلئ جديد
+    with _shared_limiters_lock:
+        limiter = _shared_limiters.get((rpm, capacity))
+        if limiter is None:
+            limiter = _shared_limiters[(rpm, capacity)] = TokenBucket(rpm / 60.0, capacity=capacity)
+        return limiter
+
+
+def is_rate_limit_error(e):
+    # أخطاء تجاوز الحصة من Google تصل بأنواع مختلفة حسب طبقة العميل
+    name = type(e).__name__
+    text = str(e)
+    return (
+        name in ("ResourceExhausted", "TooManyRequests")
+        or "429" in text
+        or "RESOURCE_EXHAUSTED" in text
+        or "quota" in text.lower()
+    )
+
+
+# =========================
+# ذاكرة تخزين المتجهات (SQLite)
+# =========================
+def normalize_text(text):
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def text_hash(text):
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    # ملف SQLite واحد يمكن أن تتشاركه عدة عمليات Streamlit على نفس الجهاز؛
+    # وضع WAL يسمح بالقراءة المتزامنة، و busy_timeout ينتظر بدل الفشل عند قفل الكتابة
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT NOT NULL, hash TEXT NOT NULL, vector BLOB NOT NULL, "
+                "PRIMARY KEY (model, hash))"
+            )
+
+    @contextmanager
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            conn.execute("PRAGMA busy_timeout=30000")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get_many(self, model, hashes):
+        found = {}
+        unique = list(set(hashes))
+        with self.connect() as conn:
+            # حدود SQLite لعدد المعاملات في الاستعلام الواحد
+            for i in range(0, len(unique), 500):
+                part = unique[i:i + 500]
+                rows = conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({','.join('?' * len(part))})",
+                    [model, *part],
+                )
+                for h, blob in rows:
+                    found[h] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def put_many(self, model, items):
+        with self.connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+                [(model, h, np.asarray(v, dtype=np.float32).tobytes()) for h, v in items],
+            )
+
+
+# =========================
+# تضمين المقاطع على دفعات متوازية
+# =========================
+def embed_batch(embeddings, batch, limiter, max_retries):
+    for attempt in range(max_retries + 1):
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            return embeddings.embed_documents(batch)
+        except Exception as e:
+            if attempt == max_retries or not is_rate_limit_error(e):
+                raise
+            # تراجع أسّي مع عشوائية بسيطة حتى لا تعود كل الخيوط في نفس اللحظة
+            time.sleep(min(60, 2 ** attempt) + random.random())
+
+
+def embed_texts(texts, embeddings, batch_size=100, max_workers=4, rpm=None, max_retries=5, progress=None,
+                cache=None, model=None, limiter=None):
+    # المقاطع المكررة أو المخزنة مسبقًا في cache لا تُرسل لمزود التضمين.
+    # limiter: محدد مشترك بين الاستدعاءات المتتالية؛ بدونه يُنشأ محدد جديد من rpm لهذا الاستدعاء فقط
+    if limiter is None and rpm:
+        limiter = TokenBucket(rpm / 60.0, capacity=max_workers)
+    if cache is None:
+        return embed_uncached(texts, embeddings, batch_size, max_workers, limiter, max_retries, progress)
+
+    hashes = [text_hash(t) for t in texts]
+    known = cache.get_many(model, hashes)
+    missing = {}
+    for h, t in zip(hashes, texts):
+        if h not in known and h not in missing:
+            missing[h] = t
+
+    if missing:
+        vectors = embed_uncached(list(missing.values()), embeddings, batch_size, max_workers, limiter, max_retries, progress)
+        new_items = list(zip(missing.keys(), vectors))
+        cache.put_many(model, new_items)
+        known.update(new_items)
+    elif progress is not None:
+        progress(len(texts), len(texts))
+
+    return [known[h] for h in hashes]
+
+
+def embed_uncached(texts, embeddings, batch_size, max_workers, limiter, max_retries, progress):
+    # تعيد المتجهات بنفس ترتيب النصوص؛ progress(done, total) تُستدعى من الخيط المستدعي
+    if not texts:
+        return []
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    vectors = [None] * len(batches)
+    done = 0
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(embed_batch, embeddings, batch, limiter, max_retries): i
+            for i, batch in enumerate(batches)
+        }
+        for future in as_completed(futures):
+            i = futures[future]
+            vectors[i] = future.result()
+            done += len(batches[i])
+            if progress is not None:
+                progress(done, len(texts))
+
+    return [v for batch_vectors in vectors for v in batch_vectors]
+
+
+# =========================
+# مزودات التضمين
+# =========================
+class HashingEmbeddings(Embeddings):
+    # تضمين محلي بلا اتصال بالشبكة: n-grams حرفية + كلمات، مجزأة إلى dim خانة
+    # بوزن لوغاريتمي للتكرار، ثم تطبيع L2 حتى يصبح الضرب الداخلي = تشابه جيب التمام
+    def __init__(self, dim=1024, ngram_range=(3, 5)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+
+    def features(self, text):
+        text = normalize_text(text).lower()
+        words = re.findall(r"\w+(?:[-./]\w+)*", text)
+        features = list(words)
+        lo, hi = self.ngram_range
+        for word in words:
+            padded = f" {word} "
+            for n in range(lo, hi + 1):
+                features.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+        return features
+
+    def embed_query(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        counts = {}
+        for feature in self.features(text):
+            counts[feature] = counts.get(feature, 0) + 1
+        for feature, count in counts.items():
+            h = zlib.crc32(feature.encode("utf-8"))
+            sign = 1.0 if h & 0x80000000 else -1.0
+            vector[h % self.dim] += sign * (1.0 + np.log(count))
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector.tolist()
+
+    def embed_documents(self, texts):
+        return [self.embed_query(t) for t in texts]
+
+
+EMBEDDING_BACKENDS = ("google", "hashing", "huggingface")
+# النموذج الافتراضي لكل مزود عندما لا يُحدد RAG_EMBEDDING_MODEL
+DEFAULT_EMBEDDING_MODELS = {
+    "google": "models/embedding-001",
+    "huggingface": "sentence-transformers/all-MiniLM-L6-v2",
+}
+
+
+def default_embedding_model(backend):
+    return DEFAULT_EMBEDDING_MODELS.get(backend, "")
+
+
+def get_embeddings(backend, model, dim=1024):
+    if backend == "google":
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+        return GoogleGenerativeAIEmbeddings(model=model)
+    if backend == "hashing":
+        return HashingEmbeddings(dim=dim)
+    if backend == "huggingface":
+        # نموذج محلي صغير (مثل sentence-transformers/all-MiniLM-L6-v2)؛ يتطلب تثبيت sentence-transformers
+        try:
+            from langchain_community.embeddings import HuggingFaceEmbeddings
+        except ImportError as e:
+            raise ImportError("مزود huggingface يتطلب: pip install sentence-transformers") from e
+        return HuggingFaceEmbeddings(model_name=model)
+    raise ValueError(f"مزود تضمين غير معروف: {backend} (المتاح: {', '.join(EMBEDDING_BACKENDS)})")
@@ -0,0 +1,951 @@
+import os
+import json
+import mmap
+import pickle
+import shutil
+import glob
+import signal
+import time
+import queue
+import hashlib
+import tempfile
+import threading
+import multiprocessing
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any
+
+from langchain_community.document_loaders import PyPDFLoader, TextLoader, UnstructuredWordDocumentLoader
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.base import Docstore
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_core.documents import Document
+
+import faiss
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: لا قفل بين العمليات، ويبقى المجلد المؤقت الفريد
+    fcntl = None
+
+from rag_embeddings import EmbeddingCache, embed_texts, get_embeddings, shared_limiter, default_embedding_model
+from rag_ann import (
+    QUANTIZED_TYPES, QuantizedIndex, resolve_index_type, build_ann_index, add_to_ann_index, write_ann_index,
+    set_search_params, flat_vectors, recall_report,
+)
+from rag_retrieval import BM25Index, MetadataIndex, DocumentIndex
+from rag_catalog import CatalogJSONLoader
+from rag_dedup import NearDuplicateFilter
+from rag_chunking import StructuredTextSplitter, detect_language
+
+MANIFEST_NAME = "manifest.json"
+ANN_INDEX_NAME = "ann.faiss"
+BM25_INDEX_NAME = "bm25.pkl"
+DEDUP_INDEX_NAME = "dedup.pkl"
+FILTERS_INDEX_NAME = "filters.pkl"
+DOCUMENTS_INDEX_NAME = "documents.pkl"
+FAISS_INDEX_NAME = "index.faiss"
+CHUNKS_BLOB_NAME = "chunks.bin"
+CHUNKS_OFFSETS_NAME = "chunks_offsets.npy"
+CHUNKS_IDS_NAME = "chunks_ids.json"
+MANIFEST_VERSION = 5
+
+
+# =========================
+# إعدادات الفهرسة
+# =========================
+@dataclass
+class IndexConfig:
+    data_dir: str = "data"
+    index_dir: str = "index"
+    # google | hashing | huggingface (انظر rag_embeddings.get_embeddings)
+    embedding_backend: str = "google"
+    # فارغ = النموذج الافتراضي للمزود (rag_embeddings.DEFAULT_EMBEDDING_MODELS)
+    embedding_model: str = ""
+    embedding_dim: int = 1024
+    # structured (يراعي الجمل والعناوين والجداول ولغة النص) أو recursive (التقسيم الحرفي القديم)
+    chunker: str = "structured"
+    chunk_size: int = 1000
+    # الحجم المستهدف للفقرات العربية؛ الحرف العربي يقابل رموزًا أكثر من الحرف الإنجليزي
+    chunk_size_ar: int = 600
+    chunk_overlap: int = 200
+    # حذف المقاطع شبه المكررة (MinHash/LSH) قبل التضمين؛ 0 يعطله
+    dedup_threshold: float = 0.85
+    dedup_num_perm: int = 128
+    # إعدادات مرحلة التضمين (لا تؤثر على محتوى الفهرس)
+    embed_batch_size: int = 100
+    embed_workers: int = 4
+    embed_rpm: int = 600
+    embed_max_retries: int = 5
+    # عدد المقاطع في كل دفعة تضمين وإدراج في الفهرس؛ 0 = embed_batch_size * embed_workers حتى
+    # تجد كل خيوط التضمين دفعة فرعية في كل دفعة (انظر index_chunk_batch_size)
+    index_batch_size: int = 0
+    # تحليل الملفات في عمليات منفصلة؛ 0 = عدد أنوية المعالج، 1 = داخل العملية نفسها
+    parse_workers: int = 0
+    parse_timeout: int = 300
+    # الملفات الأصغر من هذا الحجم تُحلل داخل العملية: تشغيل عامل جديد (استيراد langchain وfaiss)
+    # أبطأ بكثير من تحليلها
+    parse_inprocess_kb: int = 256
+    # flat | hnsw | ivfpq | binary | int8 | auto (حسب عدد المقاطع)؛ الفهرس المسطح يبقى المرجع
+    # للتحديثات. binary و int8 يبقيان الرموز المضغوطة فقط في الذاكرة ويعيدان ترتيب
+    # أفضل k * ann_rerank مرشحًا بالمتجهات الكاملة من الفهرس المسطح على القرص
+    index_type: str = "auto"
+    hnsw_m: int = 32
+    hnsw_ef_construction: int = 200
+    ann_ef_search: int = 64
+    ann_nprobe: int = 16
+    ann_rerank: int = 20
+    # تقرير الدقة مقابل الزمن: 1 = عند إعادة بناء ANN كاملًا فقط، always = مع كل تحديث، 0 = بدونه
+    ann_report: str = "1"
+    # فتح الفهرس ونصوص المقاطع بـ mmap حتى تتشارك عمليات Streamlit ذاكرة الصفحات
+    index_mmap: bool = True
+    # hybrid (FAISS + BM25 مع RRF) أو dense (FAISS فقط) أو hierarchical (أقرب
+    # retriever_documents_k ملفًا بمتجهات ملخصها، ثم البحث الهجين في مقاطعها)
+    retriever_mode: str = "hybrid"
+    retriever_k: int = 3
+    retriever_fetch_k: int = 20
+    retriever_documents_k: int = 5
+    # auto: البحث افتراضيًا في مقاطع لغة السؤال (وما لا لغة له)؛ off: في كل المقاطع
+    retriever_language: str = "auto"
+    # سقف رموز السياق المرسل للنموذج (tiktoken)؛ 0 = بدون سقف. عند تفعيله يُسترجع
+    # context_candidates مقطعًا مرتبًا وتُعبأ منها الميزانية بدل retriever_k الثابت
+    context_token_budget: int = 1500
+    context_candidates: int = 8
+    context_encoding: str = "cl100k_base"
+    # ضغط السياق قبل النموذج: نسبة الرموز المتبقية بعد اختيار الجمل ذات الصلة (0 يعطله)،
+    # ووزن تطابق الكلمات مقابل تشابه التضمين في تقييم الجمل (1 = كلمات فقط بلا تضمين)
+    context_compression: float = 0.33
+    context_compression_lexical: float = 0.5
+    # ذاكرة متجهات الأسئلة داخل العملية (LRU)؛ 0 يعطلها
+    query_cache_size: int = 1024
+    # ذاكرة الإجابات الدلالية أمام RetrievalQA؛ answer_cache_size=0 يعطلها
+    answer_cache_threshold: float = 0.95
+    answer_cache_ttl: int = 24 * 3600
+    answer_cache_size: int = 1000
+    # مستأجرون إضافيون: tenants_dir/<الاسم>/data؛ سقف ذاكرة الفهارس المحمّلة معًا (0 = بلا سقف)
+    tenants_dir: str = "tenants"
+    tenant_cache_mb: int = 1024
+    # المستأجر الذي يخدمه هذا النشر؛ الجلسات لا تصل إلى غيره. tenant_selector يسمح باختيار أي
+    # مستأجر من الرابط (?tenant=) أو القائمة الجانبية، للتجربة أو لنشر داخلي فقط
+    tenant: str = "default"
+    tenant_selector: bool = False
+    # ملف أزمنة الطلبات (سطر JSON لكل طلب)
+    metrics_path: str = "metrics/rag_latency.jsonl"
+    metrics_max_records: int = 5000
+    # ذاكرة المتجهات المشتركة خارج مجلد الفهرس؛ قيمة فارغة تعطلها
+    embed_cache_path: str = "cache/embeddings.sqlite"
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            data_dir=os.getenv("RAG_DATA_DIR", cls.data_dir),
+            index_dir=os.getenv("RAG_INDEX_DIR", cls.index_dir),
+            embedding_backend=os.getenv("RAG_EMBEDDING_BACKEND", cls.embedding_backend),
+            embedding_model=os.getenv("RAG_EMBEDDING_MODEL", cls.embedding_model),
+            embedding_dim=int(os.getenv("RAG_EMBEDDING_DIM", cls.embedding_dim)),
+            chunker=os.getenv("RAG_CHUNKER", cls.chunker),
+            chunk_size=int(os.getenv("RAG_CHUNK_SIZE", cls.chunk_size)),
+            chunk_size_ar=int(os.getenv("RAG_CHUNK_SIZE_AR", cls.chunk_size_ar)),
+            chunk_overlap=int(os.getenv("RAG_CHUNK_OVERLAP", cls.chunk_overlap)),
+            dedup_threshold=float(os.getenv("RAG_DEDUP_THRESHOLD", cls.dedup_threshold)),
+            dedup_num_perm=int(os.getenv("RAG_DEDUP_NUM_PERM", cls.dedup_num_perm)),
+            embed_batch_size=int(os.getenv("RAG_EMBED_BATCH_SIZE", cls.embed_batch_size)),
+            embed_workers=int(os.getenv("RAG_EMBED_WORKERS", cls.embed_workers)),
+            embed_rpm=int(os.getenv("RAG_EMBED_RPM", cls.embed_rpm)),
+            embed_max_retries=int(os.getenv("RAG_EMBED_MAX_RETRIES", cls.embed_max_retries)),
+            index_batch_size=int(os.getenv("RAG_INDEX_BATCH_SIZE", cls.index_batch_size)),
+            parse_workers=int(os.getenv("RAG_PARSE_WORKERS", cls.parse_workers)),
+            parse_timeout=int(os.getenv("RAG_PARSE_TIMEOUT", cls.parse_timeout)),
+            parse_inprocess_kb=int(os.getenv("RAG_PARSE_INPROCESS_KB", cls.parse_inprocess_kb)),
+            index_type=os.getenv("RAG_INDEX_TYPE", cls.index_type),
+            hnsw_m=int(os.getenv("RAG_HNSW_M", cls.hnsw_m)),
+            hnsw_ef_construction=int(os.getenv("RAG_HNSW_EF_CONSTRUCTION", cls.hnsw_ef_construction)),
+            ann_ef_search=int(os.getenv("RAG_ANN_EF_SEARCH", cls.ann_ef_search)),
+            ann_nprobe=int(os.getenv("RAG_ANN_NPROBE", cls.ann_nprobe)),
+            ann_rerank=int(os.getenv("RAG_ANN_RERANK", cls.ann_rerank)),
+            ann_report=os.getenv("RAG_ANN_REPORT", cls.ann_report),
+            index_mmap=os.getenv("RAG_INDEX_MMAP", "1") == "1",
+            retriever_mode=os.getenv("RAG_RETRIEVER_MODE", cls.retriever_mode),
+            retriever_k=int(os.getenv("RAG_RETRIEVER_K", cls.retriever_k)),
+            retriever_fetch_k=int(os.getenv("RAG_RETRIEVER_FETCH_K", cls.retriever_fetch_k)),
+            retriever_documents_k=int(os.getenv("RAG_RETRIEVER_DOCUMENTS_K", cls.retriever_documents_k)),
+            retriever_language=os.getenv("RAG_RETRIEVER_LANGUAGE", cls.retriever_language),
+            context_token_budget=int(os.getenv("RAG_CONTEXT_TOKEN_BUDGET", cls.context_token_budget)),
+            context_candidates=int(os.getenv("RAG_CONTEXT_CANDIDATES", cls.context_candidates)),
+            context_encoding=os.getenv("RAG_CONTEXT_ENCODING", cls.context_encoding),
+            context_compression=float(os.getenv("RAG_CONTEXT_COMPRESSION", cls.context_compression)),
+            context_compression_lexical=float(os.getenv("RAG_CONTEXT_COMPRESSION_LEXICAL", cls.context_compression_lexical)),
+            query_cache_size=int(os.getenv("RAG_QUERY_CACHE_SIZE", cls.query_cache_size)),
+            answer_cache_threshold=float(os.getenv("RAG_ANSWER_CACHE_THRESHOLD", cls.answer_cache_threshold)),
+            answer_cache_ttl=int(os.getenv("RAG_ANSWER_CACHE_TTL", cls.answer_cache_ttl)),
+            answer_cache_size=int(os.getenv("RAG_ANSWER_CACHE_SIZE", cls.answer_cache_size)),
+            tenants_dir=os.getenv("RAG_TENANTS_DIR", cls.tenants_dir),
+            tenant_cache_mb=int(os.getenv("RAG_TENANT_CACHE_MB", cls.tenant_cache_mb)),
+            tenant=os.getenv("RAG_TENANT", cls.tenant),
+            tenant_selector=os.getenv("RAG_TENANT_SELECTOR", "0") == "1",
+            metrics_path=os.getenv("RAG_METRICS_PATH", cls.metrics_path),
+            metrics_max_records=int(os.getenv("RAG_METRICS_MAX_RECORDS", cls.metrics_max_records)),
+            embed_cache_path=os.getenv("RAG_EMBED_CACHE", cls.embed_cache_path),
+        )
+
+    def fingerprint(self):
+        # الإعدادات التي تغيّر محتوى الفهرس؛ أي تغيير فيها يستلزم إعادة البناء
+        return {
+            "embedding_backend": self.embedding_backend,
+            "embedding_model": self.embedding_model_id(),
+            "chunker": self.chunker,
+            "chunk_size": self.chunk_size,
+            "chunk_size_ar": self.chunk_size_ar,
+            "chunk_overlap": self.chunk_overlap,
+            "dedup_threshold": self.dedup_threshold,
+            "dedup_num_perm": self.dedup_num_perm,
+        }
+
+    def embedding_model_id(self):
+        # اسم يميز متجهات كل مزود في الـ manifest وفي ذاكرة المتجهات
+        if self.embedding_backend == "hashing":
+            return f"hashing-{self.embedding_dim}"
+        return self.embedding_model or default_embedding_model(self.embedding_backend)
+
+    def index_chunk_batch_size(self):
+        # embed_texts ينتظر كل دفعاته الفرعية قبل الدفعة التالية، فدفعة أصغر من
+        # embed_batch_size * embed_workers تترك بعض الخيوط بلا عمل طوال البناء
+        return self.index_batch_size or self.embed_batch_size * max(1, self.embed_workers)
+
+    def is_remote_embedding(self):
+        return self.embedding_backend == "google"
+
+    def make_embeddings(self):
+        return get_embeddings(self.embedding_backend, self.embedding_model_id(), dim=self.embedding_dim)
+
+
+# الفهرس المحمّل: مخزن المتجهات مع الفهارس الجانبية المبنية من نفس المقاطع
+@dataclass
+class RagIndex:
+    vectorstore: FAISS
+    bm25: BM25Index
+    manifest: dict
+    filters: Any = None
+    documents: Any = None
+
+
+# =========================
+# بصمات الملفات
+# =========================
+def get_loader(file_path):
+    if file_path.endswith(".pdf"):
+        return PyPDFLoader(file_path)
+    if file_path.endswith(".txt"):
+        return TextLoader(file_path)
+    if file_path.endswith(".docx"):
+        return UnstructuredWordDocumentLoader(file_path)
+    if file_path.endswith(".json"):
+        return CatalogJSONLoader(file_path)
+    return None
+
+
+def file_sha256(file_path):
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def scan_data_dir(data_dir):
+    # {اسم الملف: بصمة المحتوى} لكل ملف مدعوم في مجلد البيانات
+    hashes = {}
+    for file in sorted(os.listdir(data_dir)):
+        file_path = os.path.join(data_dir, file)
+        if os.path.isfile(file_path) and get_loader(file_path) is not None:
+            hashes[file] = file_sha256(file_path)
+    return hashes
+
+
+def read_manifest(index_dir):
+    path = os.path.join(index_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_manifest(index_dir, manifest):
+    path = os.path.join(index_dir, MANIFEST_NAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def manifest_compatible(manifest, config):
+    # نفس إصدار الصيغة ونفس إعدادات التقطيع والتضمين؛ وإلا فالفهرس القديم غير صالح
+    return (
+        manifest is not None
+        and manifest.get("version") == MANIFEST_VERSION
+        and manifest.get("config") == config.fingerprint()
+    )
+
+
+def manifest_version(manifest):
+    # بصمة محتوى الفهرس: تتغير مع أي تغيير في الملفات أو الإعدادات أو نوع الفهرس
+    content = {k: manifest.get(k) for k in ("version", "config", "files")}
+    content["ann"] = manifest.get("ann", {}).get("type")
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def diff_files(indexed, files):
+    # indexed: ما في الـ manifest، files: ما في مجلد البيانات الآن
+    changed = [f for f, sha in files.items() if indexed.get(f, {}).get("sha256") != sha]
+    removed = [f for f in indexed if f not in files]
+    return changed, removed
+
+
+# =========================
+# بناء الفهرس وحفظه
+# =========================
+def make_splitter(config):
+    if config.chunker == "structured":
+        return StructuredTextSplitter(
+            chunk_size=config.chunk_size, chunk_size_ar=config.chunk_size_ar, chunk_overlap=config.chunk_overlap
+        )
+    # start_index يسمح لمرحلة تعبئة السياق بدمج المقاطع المتداخلة بدقة
+    return RecursiveCharacterTextSplitter(
+        chunk_size=config.chunk_size, chunk_overlap=config.chunk_overlap, add_start_index=True
+    )
+
+
+def iter_page_chunks(config, file, splitter=None):
+    # ملف ← صفحات (lazy_load) ← مقاطع كل صفحة؛ لا تُحمّل كل صفحات الملف في الذاكرة معًا
+    splitter = splitter or make_splitter(config)
+    loader = get_loader(os.path.join(config.data_dir, file))
+    for page in loader.lazy_load():
+        chunks = splitter.split_documents([page])
+        for chunk in chunks:
+            # لغة كل مقطع نصي لتصفية البحث؛ سجلات الكتالوج محايدة فتبقى بلا لغة (القيمة "" في
+            # MetadataIndex) حتى تبقى ضمن نتائج أسئلة أي لغة
+            if "record" in chunk.metadata:
+                chunk.metadata.pop("language", None)
+            else:
+                chunk.metadata.setdefault("language", detect_language(chunk.page_content))
+        yield chunks
+
+
+def iter_file_chunks(config, file, splitter=None):
+    for chunks in iter_page_chunks(config, file, splitter):
+        yield from chunks
+
+
+def load_chunks(config, file):
+    return list(iter_file_chunks(config, file))
+
+
+# =========================
+# تحليل الملفات بالتوازي
+# =========================
+class ParseTimeout(Exception):
+    pass
+
+
+class ParseError(Exception):
+    pass
+
+
+def _raise_parse_timeout(signum, frame):
+    raise ParseTimeout()
+
+
+def parse_timeout_message(config):
+    return f"تجاوز مهلة التحليل ({config.parse_timeout} ثانية)"
+
+
+def parse_file(config, file):
+    # تعمل داخل عملية فرعية: تعيد (الملف، [(نص، بيانات وصفية)]، رسالة الخطأ أو None)
+    # SIGALRM متاح فقط في الخيط الرئيسي (وهو حال العمليات الفرعية، لا خيط Streamlit)
+    use_alarm = (
+        config.parse_timeout > 0
+        and hasattr(signal, "SIGALRM")
+        and threading.current_thread() is threading.main_thread()
+    )
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _raise_parse_timeout)
+        signal.alarm(config.parse_timeout)
+    try:
+        chunks = [(c.page_content, c.metadata) for c in iter_file_chunks(config, file)]
+        return file, chunks, None
+    except ParseTimeout:
+        return file, [], parse_timeout_message(config)
+    except Exception as e:
+        return file, [], f"{type(e).__name__}: {e}"
+    finally:
+        if use_alarm:
+            signal.alarm(0)
+
+
+def stream_file_pages(config, file):
+    # تحليل داخل العملية صفحةً صفحة: [(نص، بيانات وصفية)] لكل صفحة. المحلل يعمل في خيط مستقل
+    # يسبق المستهلك بصفحتين على الأكثر؛ المهلة تحسب زمن انتظار المحلل فقط (لا زمن تضمين الدفعات
+    # بين الصفحات)، وبعدها يُترك الخيط المعلق ويُرفع ParseError. SIGALRM لا يصلح هنا: قد يقع
+    # أثناء التضمين في المستهلك، ولا يتوفر أصلًا في خيط بناء Streamlit
+    if config.parse_timeout <= 0:
+        for chunks in iter_page_chunks(config, file):
+            yield [(c.page_content, c.metadata) for c in chunks]
+        return
+
+    pages = queue.Queue(maxsize=2)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for chunks in iter_page_chunks(config, file):
+                if not put(("page", [(c.page_content, c.metadata) for c in chunks])):
+                    return
+            put(("done", None))
+        except Exception as e:
+            put(("error", e))
+
+    threading.Thread(target=produce, name=f"parse-{file}", daemon=True).start()
+    waited = 0.0
+    try:
+        while True:
+            t = time.monotonic()
+            try:
+                kind, value = pages.get(timeout=max(0.0, config.parse_timeout - waited))
+            except queue.Empty:
+                raise ParseError(parse_timeout_message(config))
+            waited += time.monotonic() - t
+            if kind == "error":
+                raise value
+            if kind == "done":
+                return
+            yield value
+    finally:
+        stop.set()
+
+
+def iter_parsed_files(config, files):
+    # يعيد (الملف، مولّد مقاطع صفحاته) لكل ملف؛ يُستهلك مولّد كل ملف قبل الانتقال للتالي، وأخطاء
+    # التحليل تُرفع منه. الملفات الصغيرة أولًا داخل العملية صفحةً صفحة (بينما تبدأ العمال على
+    # الكبيرة)، ثم الكبيرة بترتيبها. العامل يعيد الملف كاملًا دفعة واحدة، فيبقى في الذاكرة حتى
+    # workers * 2 ملفًا كبيرًا محللًا بالكامل. عدد العمال لا يتجاوز عدد الملفات الكبيرة
+    files = list(files)
+    large = [
+        file for file in files
+        if os.path.getsize(os.path.join(config.data_dir, file)) >= config.parse_inprocess_kb * 1024
+    ]
+    large_set = set(large)
+    small = [file for file in files if file not in large_set]
+    workers = min(config.parse_workers or os.cpu_count() or 1, len(large))
+    # parse_workers=1 يعني التحليل داخل العملية؛ ملف كبير واحد يبقى في عامل لعزل تعليقه ومهلته
+    if config.parse_workers == 1 or workers == 0:
+        for file in files:
+            yield file, stream_file_pages(config, file)
+        return
+
+    # spawn بدل fork: عملية Streamlit تحمل خيوطًا قد تكون ممسكة بأقفال لحظة النسخ
+    pool = multiprocessing.get_context("spawn").Pool(workers)
+    hung = False
+
+    def worker_pages(result):
+        nonlocal hung
+        try:
+            # المهلة داخل العامل هي الأساس؛ هذه للحالات المعلقة خارج بايثون
+            _, chunks, error = result.get(timeout=config.parse_timeout * 2 + 30 if config.parse_timeout > 0 else None)
+        except multiprocessing.TimeoutError:
+            hung = True
+            raise ParseError("توقف العامل عن الاستجابة")
+        if error:
+            raise ParseError(error)
+        yield chunks
+
+    try:
+        pending = deque()
+        queue_files = iter(large)
+        for file in queue_files:
+            pending.append((file, pool.apply_async(parse_file, (config, file))))
+            if len(pending) >= workers * 2:
+                break
+        for file in small:
+            yield file, stream_file_pages(config, file)
+        while pending:
+            file, result = pending.popleft()
+            yield file, worker_pages(result)
+            next_file = next(queue_files, None)
+            if next_file is not None:
+                pending.append((next_file, pool.apply_async(parse_file, (config, next_file))))
+    finally:
+        if hung:
+            pool.terminate()
+        else:
+            pool.close()
+        pool.join()
+
+
+def iter_chunk_batches(config, files, on_file_done=None):
+    # يجمع المقاطع في دفعات بحجم index_chunk_batch_size عبر الملفات. ما في الذاكرة قبل الإدراج في الفهرس:
+    # الدفعة الحالية وصفحتان من الملف المحلل داخل العملية، ونتائج العمال الكاملة (انظر iter_parsed_files)
+    batch = []
+    for file, pages in iter_parsed_files(config, list(files)):
+        sha = files[file]
+        count = 0
+        error = None
+        try:
+            for chunks in pages:
+                for text, metadata in chunks:
+                    # معرّفات ثابتة للمقاطع حتى يمكن حذفها لاحقًا عند تغيّر الملف أو حذفه
+                    batch.append((file, f"{file}:{sha[:16]}:{count}", Document(page_content=text, metadata=metadata)))
+                    count += 1
+                    if len(batch) >= config.index_chunk_batch_size():
+                        yield batch
+                        batch = []
+        except ParseError as e:
+            error = str(e)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        if error and count:
+            # الصفحات السابقة للخطأ دخلت الفهرس؛ الملف يُسجَّل بخطئه فيعاد تحليله عند تغيّره
+            print(f"⚠️ توقف تحليل الملف {file} بعد {count} مقطع: {error}")
+        elif error:
+            print(f"⚠️ تم تخطي الملف {file}: {error}")
+        if on_file_done is not None:
+            on_file_done(file, error)
+    if batch:
+        yield batch
+
+
+# =========================
+# فهارس البحث التقريبي (ANN)
+# =========================
+def build_ann(vectorstore, config, previous=None):
+    # يعيد (فهرس ANN أو None، وصفه للـ manifest)؛ يُبنى من متجهات الفهرس المسطح.
+    # previous: وصف ANN المحفوظ إن كان التحديث إضافة فقط (لا مقاطع محذوفة)؛ عندها تُضاف
+    # المتجهات الجديدة (آخر الفهرس المسطح) لفهرس ANN المحفوظ بدل إعادة بنائه
+    if vectorstore is None:
+        return None, {"type": "flat"}
+    ntotal = vectorstore.index.ntotal
+    index_type = resolve_index_type(config.index_type, ntotal)
+    if index_type == "flat":
+        return None, {"type": "flat"}
+
+    ann_index = None
+    report = None
+    if previous is not None and previous.get("type") == index_type:
+        try:
+            ann_index = read_ann_for_update(config, index_type)
+            if ann_index.ntotal > ntotal:
+                raise ValueError(f"فهرس ANN المحفوظ أكبر من الفهرس المسطح ({ann_index.ntotal} > {ntotal})")
+            add_to_ann_index(ann_index, vectorstore.index.reconstruct_n(ann_index.ntotal, ntotal - ann_index.ntotal))
+            report = previous.get("report")
+        except Exception as e:
+            print(f"⚠️ تعذر تحديث فهرس ANN المحفوظ، سيعاد بناؤه: {e}")
+            ann_index = None
+    rebuilt = ann_index is None
+    if rebuilt:
+        ann_index = build_ann_index(
+            flat_vectors(vectorstore.index), index_type,
+            hnsw_m=config.hnsw_m, ef_construction=config.hnsw_ef_construction,
+        )
+    if index_type in QUANTIZED_TYPES:
+        ann_index = QuantizedIndex(ann_index, vectorstore.index, rerank=config.ann_rerank)
+    # التقرير يكرر البحث مئات المرات؛ بعد تحديث بالإضافة يبقى تقرير آخر بناء كامل
+    if config.ann_report == "always" or (config.ann_report == "1" and rebuilt):
+        report = recall_report(vectorstore.index, ann_index, flat_vectors(vectorstore.index), index_type)
+    return ann_index, {"type": index_type, "report": report}
+
+
+def read_ann_for_update(config, index_type):
+    # قراءة كاملة في الذاكرة (لا mmap) لأن الفهرس سيُضاف إليه
+    path = os.path.join(config.index_dir, ANN_INDEX_NAME)
+    if index_type == "binary":
+        return faiss.read_index_binary(path)
+    return faiss.read_index(path)
+
+
+def read_faiss_index(path, use_mmap):
+    if use_mmap:
+        try:
+            # IO_FLAG_MMAP_IFC يقرأ المتجهات مباشرة من الملف دون نسخها للذاكرة الخاصة
+            return faiss.read_index(path, getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP))
+        except RuntimeError:
+            pass
+    return faiss.read_index(path)
+
+
+def attach_ann(vectorstore, config, index_type):
+    # يستبدل الفهرس المسطح في الذاكرة بفهرس ANN للبحث
+    path = os.path.join(config.index_dir, ANN_INDEX_NAME)
+    if index_type == "binary":
+        ann_index = QuantizedIndex(faiss.read_index_binary(path), vectorstore.index)
+    elif index_type in QUANTIZED_TYPES:
+        ann_index = QuantizedIndex(read_faiss_index(path, config.index_mmap), vectorstore.index)
+    else:
+        ann_index = read_faiss_index(path, config.index_mmap)
+    set_search_params(ann_index, nprobe=config.ann_nprobe, ef_search=config.ann_ef_search, rerank=config.ann_rerank)
+    vectorstore.index = ann_index
+    return vectorstore
+
+
+# =========================
+# نصوص المقاطع في ملف واحد مع جدول مواقع
+# =========================
+def write_chunks(vectorstore, directory):
+    # chunks.bin: سجلات JSON متتالية، chunks_offsets.npy: (البداية، الطول) لكل موقع في FAISS
+    ids = [vectorstore.index_to_docstore_id[i] for i in range(len(vectorstore.index_to_docstore_id))]
+    offsets = np.zeros((len(ids), 2), dtype=np.int64)
+    position = 0
+    with open(os.path.join(directory, CHUNKS_BLOB_NAME), "wb") as f:
+        for row, doc_id in enumerate(ids):
+            doc = vectorstore.docstore.search(doc_id)
+            record = json.dumps({"text": doc.page_content, "metadata": doc.metadata}, ensure_ascii=False).encode("utf-8")
+            f.write(record)
+            offsets[row] = (position, len(record))
+            position += len(record)
+    np.save(os.path.join(directory, CHUNKS_OFFSETS_NAME), offsets)
+    with open(os.path.join(directory, CHUNKS_IDS_NAME), "w", encoding="utf-8") as f:
+        json.dump(ids, f, ensure_ascii=False)
+
+
+class MmapDocstore(Docstore):
+    # docstore للقراءة فقط: النصوص تبقى في الملف وتُقرأ عند الطلب عبر mmap
+    def __init__(self, directory):
+        with open(os.path.join(directory, CHUNKS_IDS_NAME), "r", encoding="utf-8") as f:
+            self.ids = json.load(f)
+        self.rows = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        self.offsets = np.load(os.path.join(directory, CHUNKS_OFFSETS_NAME), mmap_mode="r")
+        with open(os.path.join(directory, CHUNKS_BLOB_NAME), "rb") as f:
+            # mmap لا يقبل ملفًا فارغًا
+            self.blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+
+    def search(self, search):
+        row = self.rows.get(search)
+        if row is None:
+            return f"ID {search} not found."
+        start, length = self.offsets[row]
+        record = json.loads(self.blob[start:start + length])
+        return Document(id=search, page_content=record["text"], metadata=record["metadata"])
+
+    def delete(self, ids):
+        raise NotImplementedError("MmapDocstore للقراءة فقط؛ التحديثات تتم على نسخة في الذاكرة")
+
+
+# =========================
+# إزالة المقاطع شبه المكررة
+# =========================
+def dedup_candidate(doc):
+    # سجلات الكتالوج قصيرة ومتشابهة البنية (تختلف في الموديل والأرقام فقط)، فلا تُقارن
+    return "record" not in doc.metadata
+
+
+def chunk_file(chunk_id):
+    # المعرّف بصيغة "الملف:البصمة:الرقم"
+    return chunk_id.rsplit(":", 2)[0]
+
+
+def make_dedup(config):
+    if config.dedup_threshold <= 0:
+        return None
+    return NearDuplicateFilter(threshold=config.dedup_threshold, num_perm=config.dedup_num_perm)
+
+
+def load_dedup(config, vectorstore):
+    # بصمات MinHash للمقاطع المحفوظة؛ تُحسب من الـ docstore إن لم تكن محفوظة
+    dedup = make_dedup(config)
+    if dedup is None or vectorstore is None:
+        return dedup
+    path = os.path.join(config.index_dir, DEDUP_INDEX_NAME)
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    for doc_id in vectorstore.index_to_docstore_id.values():
+        doc = vectorstore.docstore.search(doc_id)
+        if dedup_candidate(doc):
+            dedup.add(doc_id, doc.page_content)
+    return dedup
+
+
+def dedup_dependents(indexed, affected):
+    # ملفات حُذفت بعض مقاطعها لأنها تكرار لمقاطع في ملفات تغيّرت أو حُذفت: يعاد تحليلها
+    # حتى لا يختفي محتواها من الفهرس مع اختفاء النسخة التي أبقيناها
+    affected = set(affected)
+    dependents = []
+    while True:
+        extra = [f for f, entry in indexed.items() if f not in affected and affected & set(entry.get("duplicate_of", ()))]
+        if not extra:
+            return dependents
+        affected.update(extra)
+        dependents.extend(extra)
+
+
+def drop_near_duplicates(batch, dedup, indexed):
+    # يحذف من الدفعة ما يكرر مقطعًا في الفهرس أو سابقًا في نفس الدفعة، قبل دفع تكلفة تضمينه
+    kept = []
+    for file, chunk_id, chunk in batch:
+        if not dedup_candidate(chunk):
+            kept.append((file, chunk_id, chunk))
+            continue
+        signature = dedup.signature(chunk.page_content)
+        original = dedup.find(chunk.page_content, signature)
+        if original is None:
+            dedup.add(chunk_id, chunk.page_content, signature)
+            kept.append((file, chunk_id, chunk))
+            continue
+        entry = indexed[file]
+        entry["duplicates"] += 1
+        original_file = chunk_file(original)
+        if original_file != file and original_file not in entry["duplicate_of"]:
+            entry["duplicate_of"].append(original_file)
+    return kept
+
+
+def dedup_report(config, indexed):
+    kept = sum(len(entry["ids"]) for entry in indexed.values())
+    dropped = sum(entry.get("duplicates", 0) for entry in indexed.values())
+    total = kept + dropped
+    return {
+        "threshold": config.dedup_threshold,
+        "chunks_total": total,
+        "chunks_dropped": dropped,
+        "ratio": dropped / total if total else 0.0,
+    }
+
+
+def load_bm25(config, vectorstore):
+    path = os.path.join(config.index_dir, BM25_INDEX_NAME)
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    return BM25Index.from_vectorstore(vectorstore)
+
+
+def load_filters(config, vectorstore):
+    path = os.path.join(config.index_dir, FILTERS_INDEX_NAME)
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    return MetadataIndex.from_vectorstore(vectorstore)
+
+
+def load_documents(config, vectorstore):
+    path = os.path.join(config.index_dir, DOCUMENTS_INDEX_NAME)
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    return DocumentIndex.from_vectorstore(vectorstore)
+
+
+@contextmanager
+def index_build_lock(index_dir):
+    # كل عمليات Streamlit تبدأ البناء عند التشغيل؛ القفل يجعل واحدة فقط تبني، والبقية تنتظر
+    # ثم تجد الـ manifest محدثًا فتفتح الفهرس المحفوظ بدل إعادة بنائه
+    parent = os.path.dirname(os.path.abspath(index_dir))
+    os.makedirs(parent, exist_ok=True)
+    with open(os.path.abspath(index_dir) + ".lock", "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def remove_stale_builds(index_dir):
+    # مجلدات مؤقتة تركها بناء توقف فجأة؛ آمن تحت قفل البناء لأنه لا يوجد بناء آخر جارٍ
+    for path in glob.glob(glob.escape(os.path.abspath(index_dir)) + ".tmp-*"):
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def save_index(vectorstore, config, manifest, ann_index=None, bm25=None, dedup=None, filters=None, documents=None):
+    # الكتابة في مجلد مؤقت فريد ثم الاستبدال، حتى لا يُقرأ فهرس نصف مكتوب ولا يتشارك
+    # بناءان نفس المجلد المؤقت
+    index_dir = os.path.abspath(config.index_dir)
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(index_dir), prefix=os.path.basename(index_dir) + ".tmp-")
+    os.chmod(tmp_dir, 0o755)
+    if vectorstore is not None:
+        faiss.write_index(vectorstore.index, os.path.join(tmp_dir, FAISS_INDEX_NAME))
+        write_chunks(vectorstore, tmp_dir)
+    if ann_index is not None:
+        write_ann_index(ann_index, os.path.join(tmp_dir, ANN_INDEX_NAME))
+    if bm25 is not None:
+        with open(os.path.join(tmp_dir, BM25_INDEX_NAME), "wb") as f:
+            pickle.dump(bm25, f)
+    if dedup is not None:
+        with open(os.path.join(tmp_dir, DEDUP_INDEX_NAME), "wb") as f:
+            pickle.dump(dedup, f)
+    if filters is not None:
+        with open(os.path.join(tmp_dir, FILTERS_INDEX_NAME), "wb") as f:
+            pickle.dump(filters, f)
+    if documents is not None:
+        with open(os.path.join(tmp_dir, DOCUMENTS_INDEX_NAME), "wb") as f:
+            pickle.dump(documents, f)
+    write_manifest(tmp_dir, manifest)
+    old_dir = tmp_dir + ".old"
+    if os.path.exists(index_dir):
+        os.replace(index_dir, old_dir)
+    os.replace(tmp_dir, index_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def load_index(config, embeddings, use_mmap=False):
+    # use_mmap=True للخدمة (قراءة فقط)؛ False للتحديث لأنه يحتاج إضافة وحذف المقاطع
+    index_path = os.path.join(config.index_dir, FAISS_INDEX_NAME)
+    if not os.path.exists(index_path):
+        return None
+    index = read_faiss_index(index_path, use_mmap)
+    docstore = MmapDocstore(config.index_dir)
+    index_to_docstore_id = dict(enumerate(docstore.ids))
+    if not use_mmap:
+        docstore = InMemoryDocstore({doc_id: docstore.search(doc_id) for doc_id in docstore.ids})
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+
+def open_index(config, embeddings, manifest):
+    vectorstore = load_index(config, embeddings, use_mmap=config.index_mmap)
+    if vectorstore is None:
+        return None
+    bm25 = load_bm25(config, vectorstore)
+    filters = load_filters(config, vectorstore)
+    documents = load_documents(config, vectorstore)
+    index_type = manifest.get("ann", {}).get("type", "flat")
+    if index_type != "flat":
+        attach_ann(vectorstore, config, index_type)
+    return RagIndex(vectorstore, bm25, manifest, filters, documents)
+
+
+def load_or_build_index(config, embeddings, progress=None):
+    with index_build_lock(config.index_dir):
+        remove_stale_builds(config.index_dir)
+        return build_or_open_index(config, embeddings, progress)
+
+
+def build_or_open_index(config, embeddings, progress=None):
+    if not os.path.exists(config.data_dir):
+        os.makedirs(config.data_dir)
+
+    files = scan_data_dir(config.data_dir)
+    manifest = read_manifest(config.index_dir)
+    indexed = manifest["files"] if manifest_compatible(manifest, config) else {}
+    changed, removed = diff_files(indexed, files)
+
+    if not changed and not removed and manifest_compatible(manifest, config):
+        # لا تغيير في البيانات؛ يكفي التأكد أن نوع فهرس ANN المحفوظ هو المطلوب
+        ntotal = sum(len(entry["ids"]) for entry in indexed.values())
+        if manifest.get("ann", {}).get("type", "flat") == resolve_index_type(config.index_type, ntotal):
+            try:
+                return open_index(config, embeddings, manifest)
+            except Exception as e:
+                print(f"⚠️ تعذر تحميل الفهرس المحفوظ، سيعاد بناؤه: {e}")
+                indexed = {}
+                changed, removed = diff_files(indexed, files)
+
+    vectorstore = None
+    if indexed:
+        try:
+            vectorstore = load_index(config, embeddings)
+        except Exception as e:
+            print(f"⚠️ تعذر تحميل الفهرس المحفوظ، سيعاد بناؤه: {e}")
+            indexed = {}
+            changed, removed = diff_files(indexed, files)
+
+    changed.extend(dedup_dependents(indexed, changed + removed))
+    dedup = load_dedup(config, vectorstore)
+
+    # حذف مقاطع الملفات المحذوفة أو المعدّلة فقط، والإبقاء على الباقي كما هو
+    stale_ids = []
+    for file in removed + [f for f in changed if f in indexed]:
+        stale_ids.extend(indexed.pop(file)["ids"])
+    if stale_ids and vectorstore is not None:
+        vectorstore.delete(stale_ids)
+    if stale_ids and dedup is not None:
+        dedup.remove(stale_ids)
+    # الحذف يغيّر مواقع المتجهات في الفهرس المسطح، فلا يُحدَّث فهرس ANN بالإضافة إلا دونه
+    ann_previous = manifest.get("ann") if vectorstore is not None and not stale_ids else None
+
+    # خط معالجة متدفق: ملف ← صفحة ← مقطع ← دفعة تضمين ← إدراج في الفهرس
+    # التضمين المحلي أرخص من قراءة الذاكرة نفسها، فلا داعي لتخزينه
+    cache = EmbeddingCache(config.embed_cache_path) if config.embed_cache_path and config.is_remote_embedding() else None
+    for file in changed:
+        indexed[file] = {"sha256": files[file], "ids": []}
+        if dedup is not None:
+            indexed[file].update({"duplicates": 0, "duplicate_of": []})
+    chunks_done = 0
+    files_done = []
+    # محدد معدل واحد لكل الدفعات (ومشترك في العملية)، وإلا بدأت كل دفعة برصيد ممتلئ وتجاوز البناء الحصة
+    limiter = None
+    if config.is_remote_embedding() and config.embed_rpm:
+        limiter = shared_limiter(config.embed_rpm, config.embed_workers)
+
+    def file_done(file, error):
+        # الملف المعطوب يُسجَّل ببصمته حتى لا يعاد تحليله إلا إذا تغيّر محتواه
+        if error:
+            indexed[file]["error"] = error
+        files_done.append(file)
+        if progress is not None:
+            progress(chunks_done, len(files_done), len(changed))
+
+    for batch in iter_chunk_batches(config, {f: files[f] for f in changed}, on_file_done=file_done):
+        if dedup is not None:
+            batch = drop_near_duplicates(batch, dedup, indexed)
+            if not batch:
+                continue
+        texts = [chunk.page_content for _, _, chunk in batch]
+        metadatas = [chunk.metadata for _, _, chunk in batch]
+        ids = [chunk_id for _, chunk_id, _ in batch]
+        # تضمين الدفعة على دفعات فرعية متوازية ضمن حصة مزود الخدمة
+        vectors = embed_texts(
+            texts, embeddings,
+            batch_size=config.embed_batch_size,
+            max_workers=config.embed_workers,
+            rpm=config.embed_rpm if config.is_remote_embedding() else None,
+            max_retries=config.embed_max_retries,
+            cache=cache,
+            model=config.embedding_model_id(),
+            limiter=limiter,
+        )
+        text_embeddings = list(zip(texts, vectors))
+        if vectorstore is None:
+            vectorstore = FAISS.from_embeddings(text_embeddings, embeddings, metadatas=metadatas, ids=ids)
+        else:
+            vectorstore.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+        for file, chunk_id, _ in batch:
+            indexed[file]["ids"].append(chunk_id)
+        chunks_done += len(batch)
+        if progress is not None:
+            progress(chunks_done, len(files_done), len(changed))
+
+    # الفهرس النصي يُعاد بناؤه من الـ docstore؛ تكلفته صغيرة مقارنة بالتضمين
+    bm25 = BM25Index.from_vectorstore(vectorstore) if vectorstore is not None else None
+    # مواقع المقاطع لكل لغة/فئة/ملف لتصفية البحث داخل FAISS وBM25
+    filters = MetadataIndex.from_vectorstore(vectorstore) if vectorstore is not None else None
+    # متجه ملخص لكل ملف للاسترجاع الهرمي (retriever_mode=hierarchical)
+    documents = DocumentIndex.from_vectorstore(vectorstore) if vectorstore is not None else None
+    ann_index, ann_info = build_ann(vectorstore, config, ann_previous)
+    if dedup is not None:
+        report = dedup_report(config, indexed)
+        print(f"إزالة التكرار: {report['chunks_dropped']} من {report['chunks_total']} مقطع ({report['ratio']:.1%})")
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "config": config.fingerprint(),
+        "files": indexed,
+        "last_update": {"changed": changed, "removed": removed},
+        "ann": ann_info,
+        "dedup": dedup_report(config, indexed) if dedup is not None else None,
+    }
+    save_index(vectorstore, config, manifest, ann_index, bm25, dedup, filters, documents)
+    # نسخة التحديث في الذاكرة تُترك، ويُفتح الفهرس المحفوظ كما في أي تشغيل لاحق
+    return open_index(config, embeddings, manifest)
@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from langchain_core.embeddings import Embeddings
+
+# المراحل بترتيب مسار الطلب؛ تُعرض بهذا الترتيب في لوحة المشرف
+STAGES = (
+    "query_embedding",
+    "vector_search",
+    "prompt_assembly",
+    "llm_ttft",
+    "llm_total",
+    "source_rendering",
+    "total",
+)
+
+current_timer = ContextVar("current_timer", default=None)
+
+
+# =========================
+# قياس زمن مراحل الطلب
+# =========================
+class RequestTimer:
+    def __init__(self):
+        self.timings = {}
+        self.info = {}
+        self.started = time.perf_counter()
+
+    def add(self, stage, ms):
+        self.timings[stage] = self.timings.get(stage, 0.0) + ms
+
+    @contextmanager
+    def stage(self, name):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - t) * 1000)
+
+    @contextmanager
+    def activate(self):
+        # يجعل هذا المؤقت هو "الحالي" حتى تسجل فيه الطبقات الداخلية مثل TimedEmbeddings
+        token = current_timer.set(self)
+        try:
+            yield self
+        finally:
+            current_timer.reset(token)
+
+    def finish(self):
+        self.timings["total"] = (time.perf_counter() - self.started) * 1000
+        return self.record()
+
+    def record(self):
+        return {"ts": time.time(), **self.info, **{k: round(v, 3) for k, v in self.timings.items()}}
+
+
+class TimedEmbeddings(Embeddings):
+    # يغلف مزود التضمين ويسجل زمن تضمين السؤال في المؤقت الحالي إن وُجد
+    def __init__(self, inner):
+        self.inner = inner
+
+    def embed_documents(self, texts):
+        return self.inner.embed_documents(texts)
+
+    def embed_query(self, text):
+        t = time.perf_counter()
+        vector = self.inner.embed_query(text)
+        timer = current_timer.get()
+        if timer is not None:
+            timer.add("query_embedding", (time.perf_counter() - t) * 1000)
+        return vector
+
+
+# =========================
+# ملف المقاييس الدوّار
+# =========================
+class MetricsLog:
+    # سطر JSON لكل طلب؛ عند تجاوز ضعف max_records يُقص الملف إلى آخر max_records
+    def __init__(self, path, max_records=5000):
+        self.path = path
+        self.max_records = max_records
+        self.lock = threading.Lock()
+        self.appended = None
+
+    def append(self, record):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self.lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            if self.appended is None:
+                self.appended = len(self.read())
+            else:
+                self.appended += 1
+            if self.appended > 2 * self.max_records:
+                records = self.read()[-self.max_records:]
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.writelines(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+                os.replace(tmp_path, self.path)
+                self.appended = len(records)
+
+    def read(self):
+        if not os.path.exists(self.path):
+            return []
+        records = []
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+        return records
+
+    def summary(self, last=None):
+        records = self.read()
+        if last:
+            records = records[-last:]
+        return latency_summary(records)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def latency_summary(records):
+    rows = []
+    for stage in STAGES:
+        values = [r[stage] for r in records if stage in r]
+        if values:
+            rows.append({
+                "stage": stage,
+                "count": len(values),
+                "p50_ms": round(percentile(values, 50), 2),
+                "p95_ms": round(percentile(values, 95), 2),
+                "p99_ms": round(percentile(values, 99), 2),
+            })
+    return rows
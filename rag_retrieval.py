@@ -0,0 +1,367 @@
+import os
+import re
+import math
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Any
+
+import faiss
+import numpy as np
+from langchain_core.retrievers import BaseRetriever
+
+from rag_ann import QuantizedIndex
+from rag_chunking import detect_language
+from rag_metrics import current_timer
+
+
+# =========================
+# تقطيع الكلمات (عربي/إنجليزي)
+# =========================
+ARABIC_DIACRITICS = re.compile(r"[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]")
+ARABIC_ARTICLES = ("وال", "بال", "كال", "فال", "لل", "ال")
+TOKEN_PATTERN = re.compile(r"\w+(?:[-./]\w+)*")
+
+
+def normalize_arabic(text):
+    text = ARABIC_DIACRITICS.sub("", text)
+    text = re.sub("[إأآٱ]", "ا", text)
+    return text.replace("ة", "ه").replace("ى", "ي")
+
+
+STOP_WORDS = {normalize_arabic(w) for w in (
+    "the", "a", "an", "of", "to", "in", "on", "for", "and", "or", "is", "are", "what", "how", "do", "does",
+    "في", "من", "على", "عن", "إلى", "أو", "هل", "ما", "ماذا", "كيف", "هو", "هي", "مع", "أن", "هذا", "هذه",
+)}
+
+
+def stem_arabic(token):
+    # تجريد خفيف لأداة التعريف فقط؛ الجذور الكاملة تضر بأسماء المنتجات والأعلام
+    for article in ARABIC_ARTICLES:
+        if token.startswith(article) and len(token) - len(article) >= 2:
+            return token[len(article):]
+    return token
+
+
+def tokenize(text):
+    # أرقام الموديلات مثل CS6K-300MS تبقى رمزًا واحدًا، مع أجزائها كرموز إضافية
+    text = normalize_arabic(unicodedata.normalize("NFKC", text).lower())
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text):
+        parts = re.split(r"[-./]", token)
+        if len(parts) > 1:
+            tokens.append(token)
+            tokens.extend(p for p in parts if p)
+        elif token not in STOP_WORDS:
+            tokens.append(stem_arabic(token))
+    return tokens
+
+
+# =========================
+# فهرس BM25
+# =========================
+class BM25Index:
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.ids = []
+        self.lengths = []
+        self.postings = defaultdict(list)
+
+    @classmethod
+    def from_texts(cls, ids, texts):
+        index = cls()
+        for doc_id, text in zip(ids, texts):
+            index.add(doc_id, text)
+        return index
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore):
+        ids = [vectorstore.index_to_docstore_id[i] for i in range(len(vectorstore.index_to_docstore_id))]
+        return cls.from_texts(ids, (vectorstore.docstore.search(i).page_content for i in ids))
+
+    def add(self, doc_id, text):
+        doc = len(self.ids)
+        counts = Counter(tokenize(text))
+        self.ids.append(doc_id)
+        self.lengths.append(sum(counts.values()))
+        for token, tf in counts.items():
+            self.postings[token].append((doc, tf))
+
+    def search(self, query, k=10, allowed=None):
+        # allowed: مصفوفة منطقية بطول المستندات؛ المستبعدة لا تُحسب درجاتها أصلًا
+        if not self.ids:
+            return []
+        n = len(self.ids)
+        avg_length = sum(self.lengths) / n or 1.0
+        scores = defaultdict(float)
+        for token in set(tokenize(query)):
+            postings = self.postings.get(token)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc, tf in postings:
+                if allowed is not None and not allowed[doc]:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[doc] / avg_length)
+                scores[doc] += idf * tf * (self.k1 + 1) / (tf + norm)
+        top = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.ids[doc], score) for doc, score in top]
+
+
+# =========================
+# تصفية البحث بالبيانات الوصفية
+# =========================
+FILTER_FIELDS = ("language", "category", "source")
+
+
+class MetadataIndex:
+    # قيمة كل حقل ← مواقع المقاطع في FAISS (وهي نفس أرقام المستندات في BM25).
+    # المقاطع بلا قيمة للحقل (مثل سجلات الكتالوج بلا لغة) تُجمع تحت القيمة ""
+    def __init__(self, ntotal, fields):
+        self.ntotal = ntotal
+        self.fields = fields
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore):
+        n = len(vectorstore.index_to_docstore_id)
+        buckets = {field: defaultdict(list) for field in FILTER_FIELDS}
+        for position in range(n):
+            metadata = vectorstore.docstore.search(vectorstore.index_to_docstore_id[position]).metadata
+            for field in FILTER_FIELDS:
+                value = metadata.get(field)
+                if field == "source" and value:
+                    value = os.path.basename(value)
+                buckets[field]["" if value is None else str(value)].append(position)
+        fields = {
+            field: {value: np.asarray(positions, dtype=np.int64) for value, positions in values.items()}
+            for field, values in buckets.items()
+        }
+        return cls(n, fields)
+
+    def values(self, field):
+        return sorted(value for value in self.fields.get(field, {}) if value)
+
+    def select(self, filters):
+        # filters: {الحقل: [القيم]} ← مواقع المقاطع المطابقة لكل الحقول، أو None بلا تصفية
+        selection = None
+        for field, values in filters.items():
+            if not values:
+                continue
+            buckets = self.fields.get(field, {})
+            positions = np.concatenate([buckets.get(v, np.empty(0, dtype=np.int64)) for v in values])
+            selection = positions if selection is None else np.intersect1d(selection, positions)
+        return np.unique(selection) if selection is not None else None
+
+
+def resolve_selection(filter_index, filters, query, auto_language, k):
+    if filter_index is None:
+        return None
+    filters = dict(filters or {})
+    if auto_language and not filters.get("language"):
+        # اللغة الافتراضية هي لغة السؤال؛ المقاطع بلا لغة (سجلات الكتالوج) تبقى ضمن النتائج
+        filters["language"] = [detect_language(query), ""]
+        selection = filter_index.select(filters)
+        # التصفية الافتراضية لا يجب أن تفرغ النتائج: إن بقي أقل من k مقطع نبحث في الكل
+        if selection is not None and len(selection) < k:
+            del filters["language"]
+            selection = filter_index.select(filters)
+    else:
+        selection = filter_index.select(filters)
+    timer = current_timer.get()
+    if timer is not None:
+        timer.info["filter_candidates"] = filter_index.ntotal if selection is None else int(len(selection))
+    return selection
+
+
+def subset_search(flat_index, vectors, k, selection):
+    # حساب المسافات لمتجهات المجموعة فقط، بدل المرور على كل الفهرس مع IDSelector
+    distances, rows = faiss.knn(vectors, flat_index.reconstruct_batch(selection), k)
+    return distances, np.where(rows >= 0, selection[np.maximum(rows, 0)], -1)
+
+
+def filtered_index_search(index, vectors, k, selection):
+    # التصفية داخل FAISS (IDSelector) لا بعده: تُعاد أقرب k من المقاطع المسموحة فقط
+    small = len(selection) <= index.ntotal // 10
+    if isinstance(index, QuantizedIndex):
+        if small:
+            return subset_search(index.flat_index, vectors, k, selection)
+        return index.search(vectors, k, params=faiss.SearchParameters(sel=faiss.IDSelectorBatch(selection)))
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexFlat) and small:
+        return subset_search(index, vectors, k, selection)
+    selector = faiss.IDSelectorBatch(selection)
+    if isinstance(index, faiss.IndexHNSW):
+        if small:
+            # مجموعة صغيرة: بحث دقيق في متجهات HNSW نفسها أسرع ولا يفقد نتائج في الرسم
+            return subset_search(faiss.downcast_index(index.storage), vectors, k, selection)
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=max(index.hnsw.efSearch, k))
+    elif isinstance(index, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=index.nprobe)
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    return index.search(vectors, k, params=params)
+
+
+def query_vectors(vectorstore, query):
+    return np.asarray([vectorstore.embeddings.embed_query(query)], dtype=np.float32)
+
+
+def dense_search_ids(vectorstore, query, k, selection=None, vectors=None):
+    if vectors is None:
+        vectors = query_vectors(vectorstore, query)
+    if selection is None:
+        _, positions = vectorstore.index.search(vectors, k)
+    else:
+        k = min(k, len(selection))
+        if k == 0:
+            return []
+        _, positions = filtered_index_search(vectorstore.index, vectors, k, selection)
+    return [vectorstore.index_to_docstore_id[int(p)] for p in positions[0] if p >= 0]
+
+
+def selection_mask(selection, n):
+    if selection is None:
+        return None
+    mask = np.zeros(n, dtype=bool)
+    mask[selection] = True
+    return mask
+
+
+# =========================
+# الاسترجاع الهرمي: الملفات أولًا ثم مقاطعها
+# =========================
+class DocumentIndex:
+    # متجه ملخص لكل ملف يُحسب مرة وقت البناء: متوسط متجهات مقاطعه بعد التطبيع (المركز).
+    # المرحلة الأولى تقارن السؤال بمراكز الملفات، والثانية تبحث في مقاطع أقربها فقط
+    def __init__(self, sources, centroids, positions):
+        self.sources = sources
+        self.centroids = centroids
+        self.positions = positions
+
+    @classmethod
+    def from_vectors(cls, vectors, groups):
+        # groups: اسم ملف كل متجه بنفس ترتيب مواقع FAISS
+        members = defaultdict(list)
+        for position, group in enumerate(groups):
+            members[group].append(position)
+        sources = list(members)
+        positions = [np.asarray(members[source], dtype=np.int64) for source in sources]
+        centroids = np.zeros((len(sources), vectors.shape[1]), dtype=np.float32)
+        for row, chunk_positions in enumerate(positions):
+            centroids[row] = vectors[chunk_positions].mean(axis=0)
+        faiss.normalize_L2(centroids)
+        return cls(sources, centroids, positions)
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore):
+        n = vectorstore.index.ntotal
+        groups = [
+            vectorstore.docstore.search(vectorstore.index_to_docstore_id[position]).metadata.get("source", "")
+            for position in range(n)
+        ]
+        return cls.from_vectors(vectorstore.index.reconstruct_n(0, n), groups)
+
+    def select(self, vectors, documents_k, allowed=None):
+        # مواقع مقاطع أقرب documents_k ملفًا للسؤال؛ allowed يستبعد المقاطع خارج التصفية،
+        # والملف الذي لا يبقى له مقطع مسموح لا يُحسب ضمن العدد
+        query = vectors[0] / max(float(np.linalg.norm(vectors[0])), 1e-12)
+        chosen = []
+        for row in np.argsort(-(self.centroids @ query)):
+            chunk_positions = self.positions[row]
+            if allowed is not None:
+                chunk_positions = chunk_positions[allowed[chunk_positions]]
+            if len(chunk_positions):
+                chosen.append(chunk_positions)
+                if len(chosen) == documents_k:
+                    break
+        return np.sort(np.concatenate(chosen)) if chosen else np.empty(0, dtype=np.int64)
+
+
+# =========================
+# الدمج بترتيب المراتب (RRF)
+# =========================
+def rrf_fuse(rankings, k=60):
+    # rankings: قوائم معرّفات مرتبة؛ كل قائمة تضيف 1/(k + المرتبة) لكل معرّف
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] += 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class HybridRetriever(BaseRetriever):
+    # بحث كثيف (FAISS) + بحث نصي (BM25)، ثم دمج القائمتين بـ RRF.
+    # التصفية بالبيانات الوصفية تُطبق داخل البحثين قبل اختيار أفضل النتائج
+    vectorstore: Any
+    bm25: Any
+    k: int = 3
+    fetch_k: int = 20
+    rrf_k: int = 60
+    filter_index: Any = None
+    filters: dict = {}
+    auto_language: bool = False
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        selection = resolve_selection(self.filter_index, self.filters, query, self.auto_language, self.k)
+        vectors = query_vectors(self.vectorstore, query)
+        selection = self.narrow(selection, vectors)
+        dense = dense_search_ids(self.vectorstore, query, self.fetch_k, selection, vectors)
+        allowed = selection_mask(selection, len(self.bm25.ids))
+        sparse = [doc_id for doc_id, _ in self.bm25.search(query, k=self.fetch_k, allowed=allowed)]
+        fused = rrf_fuse([dense, sparse], k=self.rrf_k)[:self.k]
+        return [self.vectorstore.docstore.search(doc_id) for doc_id in fused]
+
+    def narrow(self, selection, vectors):
+        return selection
+
+
+class HierarchicalRetriever(HybridRetriever):
+    # مرحلتان: أقرب documents_k ملفًا بمتجهات الملخص، ثم البحث الهجين في مقاطعها فقط
+    documents: Any
+    documents_k: int = 5
+
+    def narrow(self, selection, vectors):
+        allowed = selection_mask(selection, len(self.bm25.ids))
+        narrowed = self.documents.select(vectors, self.documents_k, allowed)
+        timer = current_timer.get()
+        if timer is not None:
+            timer.info["filter_candidates"] = int(len(narrowed))
+        return narrowed
+
+
+class DenseRetriever(BaseRetriever):
+    # بحث FAISS فقط، مع نفس التصفية داخل البحث
+    vectorstore: Any
+    k: int = 3
+    filter_index: Any = None
+    filters: dict = {}
+    auto_language: bool = False
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        selection = resolve_selection(self.filter_index, self.filters, query, self.auto_language, self.k)
+        return [self.vectorstore.docstore.search(doc_id) for doc_id in dense_search_ids(self.vectorstore, query, self.k, selection)]
+
+
+def make_retriever(index, config, filters=None):
+    # filters: {"language"|"category"|"source": [القيم]}؛ بدون لغة صريحة تُستخدم لغة السؤال
+    # إذا كان RAG_RETRIEVER_LANGUAGE=auto
+    # مع ميزانية الرموز يُسترجع عدد أكبر من المرشحين ويقرر ContextBuilder كم منها يدخل
+    k = config.context_candidates if config.context_token_budget > 0 else config.retriever_k
+    common = {
+        "vectorstore": index.vectorstore,
+        "k": k,
+        "filter_index": index.filters,
+        "filters": filters or {},
+        "auto_language": config.retriever_language == "auto",
+    }
+    if config.retriever_mode == "hierarchical" and index.documents is not None:
+        return HierarchicalRetriever(
+            bm25=index.bm25,
+            fetch_k=max(config.retriever_fetch_k, k),
+            documents=index.documents,
+            documents_k=config.retriever_documents_k,
+            **common,
+        )
+    if config.retriever_mode in ("hybrid", "hierarchical"):
+        return HybridRetriever(bm25=index.bm25, fetch_k=max(config.retriever_fetch_k, k), **common)
+    return DenseRetriever(**common)
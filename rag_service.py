@@ -0,0 +1,176 @@
+import os
+import time
+import threading
+import dataclasses
+from collections import OrderedDict
+
+from rag_index import load_or_build_index, open_index, read_manifest, manifest_compatible
+
+
+# =========================
+# بناء الفهرس في الخلفية
+# =========================
+class IndexService:
+    # يخدم الفهرس المحفوظ السابق (أو لا شيء = وضع التهيئة) بينما يُبنى الفهرس الجديد
+    # في خيط خلفي، ثم يستبدله بإسناد واحد. الطلبات الجارية تكمل على النسخة القديمة:
+    # ملفاتها مفتوحة بـ mmap فتبقى صالحة بعد استبدال مجلد index/ على القرص
+    def __init__(self, config, embeddings):
+        self.config = config
+        self.embeddings = embeddings
+        self.index = None
+        self.state = "idle"  # idle | building | ready | failed
+        self.progress = {"chunks_done": 0, "files_done": 0, "files_total": 0}
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def open_previous(self):
+        # الفهرس المحفوظ صالح للخدمة ما دام بنفس إعدادات التضمين، حتى لو تغيرت الملفات
+        manifest = read_manifest(self.config.index_dir)
+        if not manifest_compatible(manifest, self.config):
+            return None
+        try:
+            return open_index(self.config, self.embeddings, manifest)
+        except Exception as e:
+            print(f"⚠️ تعذر فتح الفهرس السابق، سيعمل النظام في وضع التهيئة: {e}")
+            return None
+
+    def start(self):
+        # يبدأ بناءً جديدًا إن لم يكن هناك بناء جارٍ؛ يعيد False إن كان البناء جاريًا
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return False
+            if self.index is None:
+                self.index = self.open_previous()
+            self.state = "building"
+            self.error = None
+            self.progress = {"chunks_done": 0, "files_done": 0, "files_total": 0}
+            self.started_at = time.time()
+            self.thread = threading.Thread(target=self.build, name="rag-index-build", daemon=True)
+            self.thread.start()
+            return True
+
+    def on_progress(self, chunks_done, files_done, files_total):
+        self.progress = {"chunks_done": chunks_done, "files_done": files_done, "files_total": files_total}
+
+    def build(self):
+        try:
+            index = load_or_build_index(self.config, self.embeddings, progress=self.on_progress)
+        except Exception as e:
+            print(f"⚠️ فشل بناء الفهرس، يستمر العمل بالفهرس السابق: {e}")
+            with self.lock:
+                self.state = "failed"
+                self.error = str(e)
+                self.finished_at = time.time()
+            return
+        with self.lock:
+            self.index = index
+            self.state = "ready"
+            self.finished_at = time.time()
+
+    def current(self):
+        return self.index
+
+    def status(self):
+        with self.lock:
+            return {
+                "state": self.state,
+                "serving": self.index is not None,
+                "error": self.error,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                **self.progress,
+            }
+
+    def memory_bytes(self):
+        # تقدير ما يشغله الفهرس المحمّل: حجم ملفاته على القرص (المتجهات والنصوص وBM25)
+        return index_memory_bytes(self.config.index_dir) if self.index is not None else 0
+
+    def wait(self, timeout=None):
+        thread = self.thread
+        if thread is not None:
+            thread.join(timeout)
+        return self.index
+
+
+# =========================
+# فهارس متعددة المستأجرين في عملية واحدة
+# =========================
+DEFAULT_TENANT = "default"
+
+
+def list_tenants(config):
+    # المستأجر الافتراضي هو data/ و index/ كما كانا؛ كل مجلد فرعي في tenants_dir
+    # يحوي مجلد data/ هو مستأجر إضافي بفهرسه الخاص في tenants_dir/<الاسم>/index
+    tenants = [DEFAULT_TENANT]
+    if config.tenants_dir and os.path.isdir(config.tenants_dir):
+        for name in sorted(os.listdir(config.tenants_dir)):
+            if name != DEFAULT_TENANT and os.path.isdir(os.path.join(config.tenants_dir, name, "data")):
+                tenants.append(name)
+    return tenants
+
+
+def tenant_config(config, tenant):
+    if tenant == DEFAULT_TENANT:
+        return config
+    root = os.path.join(config.tenants_dir, tenant)
+    return dataclasses.replace(config, data_dir=os.path.join(root, "data"), index_dir=os.path.join(root, "index"))
+
+
+def index_memory_bytes(index_dir):
+    if not os.path.isdir(index_dir):
+        return 0
+    return sum(entry.stat().st_size for entry in os.scandir(index_dir) if entry.is_file())
+
+
+class TenantIndexes:
+    # خدمة فهرس لكل مستأجر، تُنشأ عند أول طلب له وتشترك في مزود التضمين نفسه.
+    # عند تجاوز max_bytes تُزال فهارس المستأجرين الأقدم استخدامًا (LRU)، عدا المطلوب الآن
+    # والذي يُبنى فهرسه. الطلبات الجارية على فهرس مُزال تكمل لأنها تحمل مرجعًا إليه
+    def __init__(self, config, embeddings, max_bytes):
+        self.config = config
+        self.embeddings = embeddings
+        self.max_bytes = max_bytes
+        self.services = OrderedDict()
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, tenant):
+        with self.lock:
+            service = self.services.get(tenant)
+            if service is None:
+                if tenant not in list_tenants(self.config):
+                    raise KeyError(f"مستأجر غير معروف: {tenant}")
+                service = IndexService(tenant_config(self.config, tenant), self.embeddings)
+                self.services[tenant] = service
+                service.start()
+            else:
+                self.services.move_to_end(tenant)
+            self.evict(keep=tenant)
+            return service
+
+    def evict(self, keep):
+        if self.max_bytes <= 0:
+            return
+        sizes = {tenant: service.memory_bytes() for tenant, service in self.services.items()}
+        total = sum(sizes.values())
+        for tenant in list(self.services):
+            if total <= self.max_bytes:
+                break
+            if tenant == keep or self.services[tenant].status()["state"] == "building":
+                continue
+            del self.services[tenant]
+            total -= sizes[tenant]
+            self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            loaded = {tenant: service.memory_bytes() for tenant, service in self.services.items()}
+        return {
+            "loaded": list(loaded),
+            "memory_bytes": sum(loaded.values()),
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,12 @@
+import numpy as np
+
+from rag_cache import SemanticAnswerCache
+
+
+def test_model_numbers_must_match_for_a_hit():
+    cache = SemanticAnswerCache(threshold=0.95)
+    vector = np.ones(8, dtype=np.float32)
+    cache.store(vector, "v1", "سعر Powerwall 2", [], "كم سعر بطارية Tesla Powerwall 2؟")
+    assert cache.lookup(vector, "v1", "كم سعر بطارية Tesla Powerwall 3؟") is None
+    answer, sources, score = cache.lookup(vector, "v1", "كم سعر بطارية tesla powerwall 2")
+    assert answer == "سعر Powerwall 2"
@@ -0,0 +1,41 @@
+import json
+
+from langchain_core.documents import Document
+
+from rag_chunking import StructuredTextSplitter
+from rag_index import IndexConfig, iter_file_chunks
+
+
+def test_short_isolated_lines_are_kept():
+    text = (
+        "Solar AI Company\n\nPhone: +967-777-444098\n\nEmail: support@solarai.com\n\n"
+        "Working hours Sunday to Thursday\n\nWe install panels for homes."
+    )
+    content = "\n".join(StructuredTextSplitter().split_text(text))
+    for line in text.split("\n\n"):
+        assert line in content
+
+
+def test_one_line_file_yields_a_chunk():
+    assert StructuredTextSplitter().split_text("brand new file with content") == ["brand new file with content"]
+
+
+def test_trailing_heading_is_its_own_chunk():
+    chunks = StructuredTextSplitter().split_text("# Intro\n\nFirst sentence here. Second one.\n\n# Appendix")
+    assert chunks == ["# Intro\n\nFirst sentence here. Second one.", "# Appendix"]
+
+
+def test_records_pass_through_unsplit():
+    record = Document(page_content="[panel] Jinko Tiger Neo 420 — price: 180", metadata={"source": "p.json", "record": 0})
+    chunks = StructuredTextSplitter().split_documents([record])
+    assert [c.page_content for c in chunks] == [record.page_content]
+    assert "language" not in chunks[0].metadata
+
+
+def test_short_catalog_records_are_indexed(tmp_path):
+    rows = [{"brand": "Jinko", "model": "Tiger Neo 420", "price": 180}, {"brand": "LONGi", "model": "Hi-MO 6", "price": 170}]
+    (tmp_path / "short_panels.json").write_text(json.dumps(rows), encoding="utf-8")
+    config = IndexConfig(data_dir=str(tmp_path), chunker="structured")
+    chunks = list(iter_file_chunks(config, "short_panels.json"))
+    assert len(chunks) == 2
+    assert "Tiger Neo 420" in chunks[0].page_content
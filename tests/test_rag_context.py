@@ -0,0 +1,31 @@
+from langchain_core.documents import Document
+
+from rag_context import ContextBuilder
+
+
+def record(row, text):
+    return Document(
+        page_content=text,
+        metadata={"source": "data/panels.json", "category": "panel", "record": row, "start_index": 0},
+    )
+
+
+def test_records_from_one_file_are_not_merged():
+    docs = [
+        record(0, "[panel] JA Solar JAM60S20 — power_w: 380; price: 250"),
+        record(1, "[panel] Canadian Solar CS6K-300MS — power_w: 300; price: 210"),
+    ]
+    packed, context, stats = ContextBuilder(token_budget=0).build(docs)
+    assert [doc.page_content for doc in packed] == [doc.page_content for doc in docs]
+    assert stats["chunks_merged"] == 0
+
+
+def test_overlapping_chunks_of_one_page_are_merged():
+    page = "first sentence here. second sentence here. third sentence here."
+    docs = [
+        Document(page_content=page[:42], metadata={"source": "data/a.txt", "start_index": 0}),
+        Document(page_content=page[21:], metadata={"source": "data/a.txt", "start_index": 21}),
+    ]
+    packed, context, stats = ContextBuilder(token_budget=0).build(docs)
+    assert [doc.page_content for doc in packed] == [page]
+    assert stats["chunks_merged"] == 1